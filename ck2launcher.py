@@ -16,7 +16,9 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
-import os, sys, glob, re, wx, datetime, ConfigParser
+import os, sys, glob, re, wx, datetime, time, signal, struct, ConfigParser, hashlib, cPickle, cStringIO, zipfile, argparse, multiprocessing, threading, sqlite3, json, resource
+from collections import OrderedDict
+from wx.lib.mixins.listctrl import CheckListCtrlMixin
 from subprocess import Popen
 from functools import reduce
 
@@ -35,6 +37,52 @@ ENDCOLOR = '\033[0m'		#: String to end color usage
 
 CONFIG_FILE = sys.path[0] + '/ck2launcher.conf'	#: Path and filename of the configuration file
 
+CACHE_DIR = sys.path[0] + '/cache'	#: Directory holding the scan cache partitions
+
+HISTORY_FILE = sys.path[0] + '/ck2launcher.db'	#: Database holding the load time history
+
+SCAN_THREADS = 8	#: Maximum number of mod roots and game installs scanned at the same time
+
+#: Glob patterns of mod descriptors, relative to a mod root (local mod folder or Steam Workshop content)
+MOD_PATTERNS = ['*.mod', '*/descriptor.mod']
+
+#: Prefix of the modfiles the launcher writes into the local mod folder for mods found in other roots
+GENERATED_PREFIX = 'ck2launcher_'
+
+GAME_POLL_INTERVAL = 1000	#: Milliseconds between two checks whether the running game has exited or finished loading
+
+READY_IDLE_CPU = 0.25		#: CPU usage (in cores) below which the game counts as idle, i.e. done loading
+READY_IDLE_TICKS = 3		#: Number of idle polls in a row after which the game counts as done loading
+
+REGRESSION_FACTOR = 1.2		#: Load times this much slower than the previous median are shown as regressions
+
+THUMBNAIL_SIZE = (125, 125)	#: Maximum size of the mod thumbnails (picture= in the modfile)
+THUMBNAIL_CACHE_SIZE = 32	#: Number of decoded mod thumbnails kept in memory
+
+BISECT_TIMEOUT = 600		#: Default seconds a bisect trial may take before the mod set counts as bad
+STOP_TIMEOUT = 10		#: Seconds a game gets to exit after being asked to before it is killed
+
+SCRIPT_DIRS = ['common', 'events', 'decisions']	#: Mod directories holding the scripts checked by the validator
+
+TEXTURE_EXTENSIONS = ('.dds', '.tga')			#: Extensions of texture files
+TEXTURE_HEADER_SIZE = 128				#: Bytes read from a texture to estimate its size (a DDS header)
+
+#: Bytes per 4x4 block of the compressed DDS formats
+DDS_BLOCK_BYTES = {'DXT1': 8, 'DXT2': 16, 'DXT3': 16, 'DXT4': 16, 'DXT5': 16, 'ATI1': 8, 'ATI2': 16, 'BC4U': 8, 'BC5U': 16}
+SCRIPT_EXTENSIONS = ('.txt', '.gui', '.gfx', '.lua')	#: Extensions of script files
+
+VALIDATE_POOL_MINIMUM = 32	#: Number of changed script files from which on the validator uses a process pool
+
+VALIDATE_CHUNKSIZE = 16		#: Number of script files handed to a validator process at once
+
+VALIDATE_SHOWN = 15		#: Number of script problems listed in the pre-launch dialog
+
+#: Bytes that are not defined in Windows-1252, the encoding the game expects
+UNDEFINED_BYTES = re.compile('[\x81\x8d\x8f\x90\x9d]')
+
+#: Tokens the validator looks at: comments, strings, braces, line ends and NUL bytes
+SCRIPT_TOKENS = re.compile('#[^\n]*|"[^"\n]*"?|[{}\n\x00]')
+
 #: Will hold the configuration parser (ConfigParser)
 config = None
 
@@ -44,6 +92,9 @@ ck2Process = None
 #: Will hold the main launcher window
 launcher = None
 
+#: Whether warnings and errors are shown in dialogs (disabled for command line commands)
+showDialogs = True
+
 #: Open logfile
 logfile = open(LOGFILE, 'a')
 
@@ -92,7 +143,8 @@ def warningMsg(text, parent=None):
   '''
   print('    {0}WARNING: {1}{2}'.format(WARNINGCOLOR, text, ENDCOLOR))
   log('WARNING: {0}'.format(text))
-  wx.MessageDialog(parent, 'WARNING: {0}'.format(text), APPNAME, wx.OK | wx.ICON_WARNING).ShowModal()
+  if showDialogs:
+    wx.MessageDialog(parent, 'WARNING: {0}'.format(text), APPNAME, wx.OK | wx.ICON_WARNING).ShowModal()
 
 
 def errorMsg(text, parent=None):
@@ -105,7 +157,8 @@ def errorMsg(text, parent=None):
   '''
   print('    {0}ERROR: {1}{2}'.format(ERRORCOLOR, text, ENDCOLOR))
   log('ERROR: {0}'.format(text))
-  wx.MessageDialog(parent, 'ERROR: {0}'.format(text), APPNAME, wx.OK | wx.ICON_ERROR).ShowModal()
+  if showDialogs:
+    wx.MessageDialog(parent, 'ERROR: {0}'.format(text), APPNAME, wx.OK | wx.ICON_ERROR).ShowModal()
   
   
 def okMsg(text):
@@ -118,6 +171,343 @@ def okMsg(text):
   print('    {0}{1}{2}'.format(OKCOLOR, text, ENDCOLOR))
   log(text)
 
+
+def splitPaths(value):
+  '''Splits a configuration value holding several paths separated by os.pathsep
+
+  Arguments:
+  value --- The configuration value
+
+  '''
+  return [os.path.expanduser(path.strip()) for path in value.split(os.pathsep) if len(path.strip()) > 0]
+
+
+def readFile(path):
+  '''Reads the whole content of a file, returns None if the file can not be opened
+
+  Arguments:
+  path --- Path of the file to read
+
+  '''
+  try:
+    datafile = open(path)
+  except IOError:
+    return None
+
+  try:
+    return datafile.read()
+  finally:
+    datafile.close()
+
+
+def scanRoots(roots, scanner, fallback=lambda root: None):
+  '''Runs the scanner for each root concurrently and returns the results in the order of the roots
+
+  Arguments:
+  roots --- List of directories to scan
+  scanner --- Function taking a single root and returning its scan result
+  fallback --- Function taking a single root and returning the result to use when its scan failed
+
+  '''
+  results = [None] * len(roots)
+  pending = iter(range(0, len(roots)))
+  lock = threading.Lock()
+
+  def work():
+    while True:
+      with lock:
+	index = next(pending, None)
+      if index is None:
+	return
+      try:
+	results[index] = scanner(roots[index])
+      except Exception, error:
+	# A damaged file must not stop the other scans or leave a hole in the results
+	infoMsg('Unable to scan "{0}": {1}'.format(getattr(roots[index], 'path', roots[index]), error))
+	results[index] = fallback(roots[index])
+
+  # Plain threads, a ThreadPool spends 100ms shutting down its helper threads
+  threads = [threading.Thread(target=work) for thread in range(0, min(len(roots), SCAN_THREADS))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  return results
+
+
+
+def statKey(path):
+  '''Returns the stat information that decides whether a cache entry is still valid, None if the file is missing
+
+  Arguments:
+  path --- Path of the cached file
+
+  '''
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+
+  return (st.st_mtime, st.st_size)
+
+
+
+class StatCache:
+  '''A cache partition whose entries stay valid as long as the file they were created from is unchanged
+  '''
+
+  def __init__(self, name):
+    '''Creates a cache partition and loads its entries from disk (if available)
+
+    Arguments:
+    name --- Name of the partition, used as filename in the cache directory
+
+    '''
+    self.name = name					#: Name of the partition
+    self.filename = CACHE_DIR + '/' + name + '.cache'	#: File the partition is stored in
+    self.entries = {}					#: Cached values: path -> (stat key, value)
+    self.changed = False				#: Whether the partition has to be written to disk
+    self.hits = 0					#: Number of lookups answered from the cache
+    self.misses = 0					#: Number of lookups that had to be computed again
+    self.lock = threading.Lock()			#: Guards the entries, the scans and analyses use the partition from their own threads
+
+    try:
+      cachefile = open(self.filename, 'rb')
+    except IOError:
+      # Nothing cached yet
+      return
+
+    try:
+      self.entries = cPickle.load(cachefile)
+    except (EOFError, ValueError, cPickle.UnpicklingError):
+      # Damaged cache, start over
+      infoMsg('Discarding damaged cache partition "{0}".'.format(self.name))
+      self.entries = {}
+    finally:
+      cachefile.close()
+
+
+  def get(self, path, key=None):
+    '''Returns the cached value for a file, or None if it is not cached or the file changed
+
+    Arguments:
+    path --- Path of the cached file
+    key --- Stat key of the file, taken from disk when not given
+
+    '''
+    if key is None:
+      key = statKey(path)
+
+    with self.lock:
+      entry = self.entries.get(path)
+      if entry is None or key is None or entry[0] != key:
+	self.misses += 1
+	return None
+
+      self.hits += 1
+      return entry[1]
+
+
+  def put(self, path, value, key=None):
+    '''Stores the value computed for a file
+
+    Arguments:
+    path --- Path of the cached file
+    value --- The value to store
+    key --- Stat key of the file, taken from disk when not given
+
+    '''
+    if key is None:
+      key = statKey(path)
+
+    if key is not None:
+      with self.lock:
+	self.entries[path] = (key, value)
+	self.changed = True
+
+
+  def prune(self, paths):
+    '''Drops all entries for files not in paths
+
+    Arguments:
+    paths --- The paths that are still in use
+
+    '''
+    paths = set(paths)
+    with self.lock:
+      for path in self.entries.keys():
+	if path not in paths:
+	  del self.entries[path]
+	  self.changed = True
+
+
+  def save(self):
+    '''Writes the partition to disk if it changed
+    '''
+    with self.lock:
+      if not self.changed:
+	return
+
+      try:
+	if not os.path.exists(CACHE_DIR):
+	  os.mkdir(CACHE_DIR)
+
+	# Write to a temporary file first so an interrupted write never leaves a broken partition behind
+	cachefile = open(self.filename + '.tmp', 'wb')
+	cPickle.dump(self.entries, cachefile, cPickle.HIGHEST_PROTOCOL)
+	cachefile.close()
+	os.rename(self.filename + '.tmp', self.filename)
+	self.changed = False
+      except (IOError, OSError):
+	infoMsg('Unable to write cache partition "{0}".'.format(self.name))
+
+# END CLASS StatCache
+
+
+#: All cache partitions loaded so far, by name
+caches = {}
+
+#: Guards the cache partitions, getCache is also called outside the main thread
+cachesLock = threading.Lock()
+
+
+def getCache(kind, root):
+  '''Returns the cache partition of a root, loading it when used for the first time
+
+  Arguments:
+  kind --- What is cached (mods, dlcs, ...)
+  root --- The directory the partition belongs to
+
+  '''
+  global caches
+
+  name = '{0}-{1}'.format(kind, hashlib.md5(os.path.abspath(root)).hexdigest()[:12])
+  with cachesLock:
+    if name not in caches:
+      caches[name] = StatCache(name)
+
+    return caches[name]
+
+
+def saveCaches():
+  '''Writes all changed cache partitions to disk
+  '''
+  global caches
+
+  with cachesLock:
+    partitions = caches.values()
+
+  for cache in partitions:
+    cache.save()
+
+
+#: Current metric values: (name, labels) -> value, labels being a tuple of (label, value) tuples
+metrics = {}
+
+#: All metrics with their help text
+METRICS = {
+  'ck2launcher_scan_duration_seconds': 'Seconds the last scan of mods or DLC\'s took',
+  'ck2launcher_mods': 'Number of mods found in all mod roots',
+  'ck2launcher_dlcs': 'Number of DLC\'s found in a game install',
+  'ck2launcher_cache_hits_total': 'Cache lookups answered from the cache',
+  'ck2launcher_cache_misses_total': 'Cache lookups that had to be computed again',
+  'ck2launcher_cache_hit_ratio': 'Share of cache lookups answered from the cache',
+  'ck2launcher_resolve_duration_seconds': 'Seconds it took to resolve the load order of the last launch',
+  'ck2launcher_selected_mods': 'Number of mods loaded by the last launch',
+  'ck2launcher_launch_latency_seconds': 'Seconds from clicking the run button, after the checks asking whether to run anyway, until the game process was started',
+  'ck2launcher_game_load_seconds': 'Seconds the last game took to finish loading',
+  'ck2launcher_game_exit_code': 'Exit code of the last game',
+  'ck2launcher_game_session_seconds': 'Seconds the last game was running',
+  'ck2launcher_game_peak_rss_bytes': 'Peak resident memory of the last game',
+  'ck2launcher_peak_rss_bytes': 'Peak resident memory of the launcher',
+  'ck2launcher_startup_seconds': 'Seconds from starting the launcher until its window was shown',
+}
+
+
+def setMetric(name, value, **labels):
+  '''Sets the value of a metric, it is exported with the next writeMetrics
+  
+  Arguments:
+  name --- Name of the metric, one of METRICS
+  value --- The value
+  labels --- Labels of the metric
+  
+  '''
+  global metrics
+  
+  metrics[(name, tuple(sorted(labels.items())))] = value
+
+
+def setCacheMetrics():
+  '''Sets the cache metrics from the counters of all loaded cache partitions
+  '''
+  global caches
+  
+  with cachesLock:
+    partitions = caches.values()
+  
+  counters = {}
+  for cache in partitions:
+    kind = cache.name.split('-')[0]
+    hits, misses = counters.get(kind, (0, 0))
+    counters[kind] = (hits + cache.hits, misses + cache.misses)
+  
+  for kind, (hits, misses) in counters.items():
+    setMetric('ck2launcher_cache_hits_total', hits, cache=kind)
+    setMetric('ck2launcher_cache_misses_total', misses, cache=kind)
+    if hits + misses > 0:
+      setMetric('ck2launcher_cache_hit_ratio', hits / float(hits + misses), cache=kind)
+
+
+def writeMetrics(event):
+  '''Exports all metrics to the configured Prometheus textfile and JSON lines file
+  
+  Arguments:
+  event --- What happened (scan, launch, exit, ...), only written to the JSON lines file
+  
+  '''
+  global config, metrics
+  
+  setCacheMetrics()
+  setMetric('ck2launcher_peak_rss_bytes', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+  
+  try:
+    # Prometheus textfile, written to a temporary file first so the node exporter never reads half of it
+    textfile = os.path.expanduser(config.get('launcher', 'metricsfile'))
+    if len(textfile) > 0:
+      lines = []
+      for name in sorted(METRICS):
+	values = sorted((labels, value) for (metric, labels), value in metrics.items() if metric == name)
+	if len(values) == 0:
+	  continue
+	
+	lines.append('# HELP {0} {1}'.format(name, METRICS[name]))
+	lines.append('# TYPE {0} {1}'.format(name, 'counter' if name.endswith('_total') else 'gauge'))
+	for labels, value in values:
+	  labelText = ','.join('{0}="{1}"'.format(label, str(text).replace('\\', '\\\\').replace('"', '\\"')) for label, text in labels)
+	  lines.append('{0}{1} {2}'.format(name, '{' + labelText + '}' if len(labels) > 0 else '', repr(float(value))))
+      
+      metricfile = open(textfile + '.tmp', 'w')
+      metricfile.write('\n'.join(lines) + '\n')
+      metricfile.close()
+      os.rename(textfile + '.tmp', textfile)
+    
+    # JSON lines, each event is appended with a single write
+    jsonfile = os.path.expanduser(config.get('launcher', 'metricsjson'))
+    if len(jsonfile) > 0:
+      entry = {'time': time.time(), 'event': event, 'metrics': []}
+      for (name, labels), value in sorted(metrics.items()):
+	entry['metrics'].append({'name': name, 'labels': dict(labels), 'value': value})
+      
+      descriptor = os.open(jsonfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+      try:
+	os.write(descriptor, json.dumps(entry) + '\n')
+      finally:
+	os.close(descriptor)
+  except (IOError, OSError), error:
+    infoMsg('Unable to write metrics: {0}'.format(error))
+
 # Taken from http://code.activestate.com/recipes/577413-topological-sort/
 # or rather http://code.activestate.com/recipes/578272-topological-sort/
 # I don't actually know any python, so any changes are messy
@@ -157,28 +547,116 @@ items in the preceeding sets.
               for item, dep in data.iteritems()
                   if item not in ordered}
   assert not data, "Cyclic dependencies exist among these items:\n%s" % '\n'.join(repr(x) for x in data.iteritems())
+
+
+def buildCommand(mods, excludedDlcs):
+  '''Returns the command that runs the game with the given mods and without the given DLC's
+  
+  Arguments:
+  mods --- The mods to load, in load order
+  excludedDlcs --- The DLC's to exclude
+  
+  '''
+  global config
+  
+  command = []
+  if len(config.get('launcher', 'prepend').strip()) > 0:
+    command = config.get('launcher', 'prepend').split(' ')
+  command.append(config.get('launcher', 'gamepath') + '/' + config.get('launcher', 'gamebinary'))
+  
+  for mod in mods:
+    command.append(mod.modArgument())
+  
+  for dlc in excludedDlcs:
+    command.append('-exclude_dlc=dlc/' + dlc.filename)
+  
+  return command
+
+
+def sortMods(mods):
+  '''Returns the mods in the order the game has to load them, dependencies first
+  
+  Arguments:
+  mods --- The mods to sort
+  
+  '''
+  # Figure out the dependencies of the mods (if any)
+  # Step 1: force them in the format toposort2 expects (a dictionary where
+  # the key is what the value(s) depend on)
+  # Step 2: apply toposort2
+  # Step 3: get the order back based on the names
+  # BTW: this assumes no duplicate names
+  if len(mods) == 0:
+    return []
+  
+  hashedMods = dict()
+  for mod in mods:
+    if mod.dependencies:
+      for dep in mod.dependencies:
+        if dep in hashedMods:
+          hashedMods[dep].add(mod.name)
+        else:
+          hashedMods[dep] = set([mod.name])
+    if mod.name not in hashedMods:
+      hashedMods[mod.name] = set([])
+  sortednames = [item for sublist in toposort2(hashedMods) for item in sublist]
+  remaining = list(mods)
+  sortedMods = []
+  for modName in sortednames:
+    for mod in remaining[:]:
+      if mod.name == modName:
+        sortedMods.append(mod)
+        remaining.remove(mod)
+        break
+  
+  return sortedMods
+  
+
+def listField(moddata, key):
+  '''Returns the quoted entries of a list field (key = { "a" "b" }) of a modfile, None if the field is missing
+  
+  Arguments:
+  moddata --- Content of the modfile
+  key --- Name of the field
+  
+  '''
+  field = re.search('^' + key + '[ \t]*=[ \t]*{([^}]*)}', moddata, re.MULTILINE)
+  if (hasattr(field, 'group')):
+    return re.findall('"([^"]+)"', field.group(1))
   
+  return None
+
 
 class Mod:
   '''Represents a mod
   
   '''
   
-  def __init__(self, filename):
+  def __init__(self, filename, root, moddata):
     ''' Creates a new mod
     
     Arguments:
-    filename --- The file the mod is contained in mod
+    filename --- The file the mod is contained in, relative to its root
+    root --- The mod root (local mod folder, Steam Workshop content, ...) the mod was found in
+    moddata --- Content of the modfile, None if it could not be read
     
     '''
     infoMsg('Found modfile: "{0}".'.format(filename))
     
-    self.filename = filename	#: The file the mod is contained in
+    self.filename = filename	#: The file the mod is contained in, relative to its root
+    self.source = root		#: The mod root the mod was found in
+    self.path = os.path.join(root, filename)	#: Full path of the modfile
     self.name = ''		#: The name of the mod
     self.directory = ''		#: The directory the mod saves data in (savegames, configuration , ...)
+    self.remoteId = None	#: The Steam Workshop id of the mod (if available)
+    self.content = None		#: The directory or archive holding the mod content, as declared in the modfile
+    self.supportedVersion = None	#: The game version the mod supports, '*' matching any part (if declared)
+    self.incompatibilities = []	#: Names of the mods this mod does not work with
+    self.requiredDlcs = []	#: Names or files of the DLC's this mod needs
+    self.picture = None		#: The thumbnail of the mod, relative to its content (if declared)
     
     # Get mod information
-    self.getModInfo()
+    self.getModInfo(moddata)
     
     if len(self.directory) > 0:
       # This mod should have a directory to store data in, checking if it exists
@@ -188,23 +666,24 @@ class Mod:
 	okMsg('Created data directory for mod "{0}": "{1}"'.format(self.name, self.directory))
     
   
-  # Opens the modfile of the current mod and gets it's name and user_dir
-  def getModInfo(self):
+  # Parses the modfile of the current mod and gets it's name and user_dir
+  def getModInfo(self, moddata):
     '''Gets all needed information about this mod
+    
+    Arguments:
+    moddata --- Content of the modfile, None if it could not be read
+    
     '''
     global config, launcher
     
-    # Try opening the modfile
-    try:
-      modfile = open(config.get('launcher', 'modpath') + '/' + self.filename)
-    except IOError:
+    self.dependencies = None
+    
+    if moddata is None:
       # Unable to open modfile
-      errorMsg('Unable to load modfile "{0}"! Check permissions.'.format(self.filename), launcher)
+      errorMsg('Unable to load modfile "{0}"! Check permissions.'.format(self.path), launcher)
       self.name = self.filename
       return
     
-    moddata = modfile.read()
-    
     # Get mod name
     try:
       self.name = re.search('^name[ \t]*=[ \t]*"(.*)"', moddata, re.MULTILINE).group(1)
@@ -220,11 +699,141 @@ class Mod:
     else:
       self.directory = ''
 
-    self.dependencies = re.search('^dependencies[ \t]*=[ \t]*{([^}]*)}', moddata, re.MULTILINE)
-    if (hasattr(self.dependencies, 'group')):
-      self.dependencies = re.findall('"([^"]+)"', self.dependencies.group(1))
+    self.dependencies = listField(moddata, 'dependencies')
+    
+    # Get compatibility declarations (if available)
+    self.supportedVersion = re.search('^supported_version[ \t]*=[ \t]*"(.*)"', moddata, re.MULTILINE)
+    if (hasattr(self.supportedVersion, 'group')):
+      self.supportedVersion = self.supportedVersion.group(1)
+    else:
+      self.supportedVersion = None
+    self.incompatibilities = listField(moddata, 'incompatibilities') or []
+    self.requiredDlcs = listField(moddata, 'required_dlcs') or []
+    
+    # Get thumbnail (if available)
+    self.picture = re.search('^picture[ \t]*=[ \t]*"(.*)"', moddata, re.MULTILINE)
+    if (hasattr(self.picture, 'group')):
+      self.picture = self.picture.group(1)
+    else:
+      self.picture = None
+    
+    # Get content directory or archive (if available)
+    self.content = re.search('^(path|archive)[ \t]*=[ \t]*"(.*)"', moddata, re.MULTILINE)
+    if (hasattr(self.content, 'group')):
+      self.content = self.content.group(2)
+    else:
+      self.content = None
+    
+    # Get Steam Workshop id (if available)
+    self.remoteId = re.search('^remote_file_id[ \t]*=[ \t]*"?([0-9]+)"?', moddata, re.MULTILINE)
+    if (hasattr(self.remoteId, 'group')):
+      self.remoteId = self.remoteId.group(1)
     else:
-      self.dependencies = None
+      self.remoteId = None
+    
+  
+  def identity(self):
+    '''Returns the key used to recognize the same mod found in several roots
+    '''
+    if self.remoteId is not None:
+      return ('remote', self.remoteId)
+    
+    return ('name', self.name)
+    
+  
+  def isSelectedIn(self, entries):
+    '''Returns whether this mod is one of the selected mods stored in the configuration
+    
+    Arguments:
+    entries --- The stored entries: full paths of the modfiles, or modfiles relative to the local mod folder as stored by earlier versions
+    
+    '''
+    return os.path.abspath(self.path) in entries or (self.isLocal() and self.filename in entries)
+    
+  
+  def isLocal(self):
+    '''Returns whether the mod was found in the local mod folder
+    '''
+    global config
+    
+    return os.path.abspath(self.source) == os.path.abspath(config.get('launcher', 'modpath'))
+    
+  
+  def contentPath(self):
+    '''Returns the directory or archive holding the content of this mod, None if it can not be found
+    '''
+    global config
+    
+    if self.content is None:
+      return None
+    
+    if os.path.isabs(self.content):
+      return self.content
+    
+    # The game resolves content relative to its user directory, Workshop descriptors sometimes relative to themselves
+    for base in [os.path.dirname(config.get('launcher', 'modpath')), os.path.dirname(self.path)]:
+      path = os.path.join(base, self.content)
+      if os.path.exists(path):
+	return path
+    
+    return None
+    
+  
+  def readPicture(self):
+    '''Reads the thumbnail of this mod, returns None if it has none or it can not be read
+    '''
+    if self.picture is None:
+      return None
+    
+    content = self.contentPath()
+    if content is not None and zipfile.is_zipfile(content):
+      # Opened separately, the archives of readModFile may be closed by another thread
+      try:
+	archive = zipfile.ZipFile(content)
+	try:
+	  return archive.read(self.picture)
+	finally:
+	  archive.close()
+      except (IOError, KeyError, zipfile.BadZipfile):
+	return None
+    
+    for base in [content, os.path.dirname(self.path)]:
+      if base is not None and os.path.isfile(os.path.join(base, self.picture)):
+	return readFile(os.path.join(base, self.picture))
+    
+    return None
+    
+  
+  def modArgument(self):
+    '''Returns the command line argument that makes the game load this mod
+    '''
+    global config
+    
+    if self.isLocal():
+      return '-mod=mod/' + self.filename
+    
+    # The game only loads modfiles from the local mod folder. Like the Paradox launcher does for
+    # Workshop mods, a modfile pointing to the content by its full path is written there.
+    filename = GENERATED_PREFIX + (self.remoteId or hashlib.md5(os.path.abspath(self.path)).hexdigest()[:12]) + '.mod'
+    moddata = readFile(self.path) or ''
+    content = self.contentPath()
+    if content is not None:
+      moddata = re.sub('^(path|archive)([ \t]*=[ \t]*)"(.*)"',
+		       lambda match: '{0}{1}"{2}"'.format(match.group(1), match.group(2), os.path.abspath(content)), moddata, flags=re.MULTILINE)
+    
+    path = os.path.join(config.get('launcher', 'modpath'), filename)
+    if readFile(path) != moddata:
+      try:
+	modfile = open(path, 'w')
+	try:
+	  modfile.write(moddata)
+	finally:
+	  modfile.close()
+      except IOError, error:
+	infoMsg('Unable to write modfile "{0}": {1}'.format(path, error))
+	return '-mod=' + self.path
+    
+    return '-mod=mod/' + filename
     
 # END CLASS Mod
 
@@ -234,11 +843,12 @@ class DLC:
   '''Represents a DLC
   '''
   
-  def __init__(self, dlcfile):
+  def __init__(self, dlcfile, dlcdata):
     '''Creates a new dlc object
     
     Arguments:
-    dlcfile --- The file the dlc is stored in
+    dlcfile --- The file the dlc is stored in, relative to the dlc directory
+    dlcdata --- Content of the dlc file, None if it could not be read
     
     '''
     infoMsg('Found DLC file: "{0}"'.format(dlcfile))
@@ -246,26 +856,25 @@ class DLC:
     self.name = ''		#: The name of the dlc
     
     # Get information about this dlc
-    self.getDLCInfo()
+    self.getDLCInfo(dlcdata)
     
   
   
-  def getDLCInfo(self):
+  def getDLCInfo(self, dlcdata):
     '''Gets information about the current dlc
+    
+    Arguments:
+    dlcdata --- Content of the dlc file, None if it could not be read
+    
     '''
     global launcher
     
-    # Open dlc file
-    try:
-      dlcfile = open(self.filename)
-    except IOError:
+    if dlcdata is None:
       # Unable to open dlcfile
       errorMsg('Unable to open DLC file "{0}". Check permissions.'.format(self.filename), launcher)
       self.name = self.filename
       return
     
-    dlcdata = dlcfile.read()
-    
     # Extract name
     try:
       self.name = re.search('^name[ \t]*=[ \t]*"(.*)"', dlcdata, re.MULTILINE).group(1)
@@ -278,66 +887,502 @@ class DLC:
 # END CLASS dlc
 
 
-# The main launher window
-class Launcher(wx.Frame):
-  '''The main launcher window
+
+class GameInstall:
+  '''Represents an installed copy of the game
   '''
   
-  def __init__(self, parent, title):
-    '''Creates a new launcher window
+  def __init__(self, path, version, dlcs):
+    '''Creates a new game install
     
-    Parameters:
-    parent --- The parent of the window
-    title --- The tile of the window
+    Arguments:
+    path --- The game directory
+    version --- The detected game version
+    dlcs --- List of DLC's found in the game directory
     
     '''
-    wx.Frame.__init__(self, parent, title=title, style=wx.CAPTION|wx.CLOSE_BOX)
+    self.path = path		#: The game directory
+    self.version = version	#: The detected game version
+    self.dlcs = dlcs		#: List of DLC's found in the game directory
+    self.files = None		#: Set of the files of the install, relative to the game directory (read on first use)
     
-    # Initialize the UI
-    self.initUI()
+  
+  def label(self):
+    '''Returns the text shown for this install in the game selection
+    '''
+    return '{0} ({1})'.format(self.path, self.version)
+    
+  
+  def vanillaFiles(self):
+    '''Returns the set of files of the install, relative to the game directory
+    '''
+    if self.files is None:
+      files = set()
+      for dirpath, dirnames, filenames in os.walk(self.path):
+	for filename in filenames:
+	  files.add(os.path.relpath(os.path.join(dirpath, filename), self.path).replace(os.sep, '/'))
+      self.files = files
     
+    return self.files
     
   
-  def initUI(self):
-    '''Initializes the UI
+# END CLASS GameInstall
+
+
+
+def versionSupported(pattern, version):
+  '''Returns whether a game version matches the supported_version of a mod
+  
+  Arguments:
+  pattern --- The supported version, '*' matching any part (2.8.*)
+  version --- The game version (2.8.3.1)
+  
+  '''
+  if version == 'unknown':
+    return True
+  
+  versionParts = version.split('.')
+  for index, part in enumerate(pattern.strip().split('.')):
+    if part == '*':
+      return True
+    if index >= len(versionParts) or part != versionParts[index]:
+      return False
+  
+  return True
+
+
+
+class Compatibility:
+  '''Compatibility of each mod with the game version, the enabled DLC's and the other selected mods.
+  Computed once after scanning, then kept up to date as mods and DLC's are checked, so the warnings
+  of a mod are a lookup.
+  '''
+  
+  def __init__(self, mods, install, enabledDlcs, selectedMods):
+    '''Computes the compatibility of all mods
+    
+    Arguments:
+    mods --- All mods
+    install --- The selected game install
+    enabledDlcs --- The enabled DLC's
+    selectedMods --- The selected mods
+    
     '''
+    self.versionIssues = {}		#: Mod -> warning about the game version, None if the version is supported
+    self.missingDlcs = {}		#: Mod -> set of the names of required DLC's that are not enabled
+    self.requiredBy = {}		#: DLC -> list of mods requiring it
+    self.conflicts = {}			#: Mod -> set of mods it is incompatible with, declared by either of them
+    self.selectedConflicts = {}		#: Mod -> set of selected mods it is incompatible with
+    
+    byName = dict((mod.name, mod) for mod in mods)
+    dlcsByKey = {}
+    for dlc in install.dlcs:
+      dlcsByKey[dlc.name] = dlc
+      dlcsByKey[dlc.filename] = dlc
+    
+    enabled = set(enabledDlcs)
+    selected = set(selectedMods)
+    for mod in mods:
+      # Game version
+      self.versionIssues[mod] = None
+      if mod.supportedVersion is not None and not versionSupported(mod.supportedVersion, install.version):
+	self.versionIssues[mod] = 'made for {0}, game is {1}'.format(mod.supportedVersion, install.version)
+      
+      # DLC's, the ones not installed are always missing
+      self.missingDlcs[mod] = set()
+      for required in mod.requiredDlcs:
+	dlc = dlcsByKey.get(required)
+	if dlc is None:
+	  self.missingDlcs[mod].add(required)
+	  continue
+	
+	self.requiredBy.setdefault(dlc, []).append(mod)
+	if dlc not in enabled:
+	  self.missingDlcs[mod].add(dlc.name)
+      
+      # Other mods, incompatibilities go both ways
+      self.conflicts.setdefault(mod, set())
+      for name in mod.incompatibilities:
+	if name in byName and byName[name] is not mod:
+	  self.conflicts[mod].add(byName[name])
+	  self.conflicts.setdefault(byName[name], set()).add(mod)
     
-    #: The main container for the window
-    self.panel = wx.Panel(self, -1)
+    for mod in mods:
+      self.selectedConflicts[mod] = self.conflicts[mod] & selected
     
-    #: The Sizer for the main window
-    self.box = wx.BoxSizer(wx.VERTICAL)
+  
+  def setDlcEnabled(self, dlc, enabled):
+    '''Updates the compatibility after a DLC was checked or unchecked, returns the mods whose warnings changed
     
-    # CK2 logo
-    logoBitmap = wx.Image(sys.path[0] + '/ck2.png', wx.BITMAP_TYPE_ANY).ConvertToBitmap()
-    logo = wx.StaticBitmap(self.panel, bitmap=logoBitmap, size=(-1, 125))
+    Arguments:
+    dlc --- The DLC
+    enabled --- Whether the DLC is enabled now
+    
+    '''
+    mods = self.requiredBy.get(dlc, [])
+    for mod in mods:
+      if enabled:
+	self.missingDlcs[mod].discard(dlc.name)
+      else:
+	self.missingDlcs[mod].add(dlc.name)
+    
+    return mods
+    
+  
+  def setModSelected(self, mod, selected):
+    '''Updates the compatibility after a mod was checked or unchecked, returns the mods whose warnings changed
+    
+    Arguments:
+    mod --- The mod
+    selected --- Whether the mod is selected now
+    
+    '''
+    for other in self.conflicts[mod]:
+      if selected:
+	self.selectedConflicts[other].add(mod)
+      else:
+	self.selectedConflicts[other].discard(mod)
+    
+    return list(self.conflicts[mod])
+    
+  
+  def warnings(self, mod):
+    '''Returns the warnings of a mod
+    
+    Arguments:
+    mod --- The mod
+    
+    '''
+    warnings = []
+    if self.versionIssues[mod] is not None:
+      warnings.append(self.versionIssues[mod])
+    if len(self.missingDlcs[mod]) > 0:
+      warnings.append('needs ' + ', '.join(sorted(self.missingDlcs[mod])))
+    if len(self.selectedConflicts[mod]) > 0:
+      warnings.append('incompatible with ' + ', '.join(sorted(other.name for other in self.selectedConflicts[mod])))
+    
+    return warnings
+    
+  
+# END CLASS Compatibility
+
+
+#: Fonts created so far: (size, weight) -> font
+fonts = {}
+
+
+def getFont(size, weight=wx.FONTWEIGHT_NORMAL):
+  '''Returns a font of the default family, created only once
+  
+  Arguments:
+  size --- Point size of the font
+  weight --- Weight of the font
+  
+  '''
+  global fonts
+  
+  if (size, weight) not in fonts:
+    fonts[(size, weight)] = wx.Font(size, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, weight)
+  
+  return fonts[(size, weight)]
+
+
+def imageBuffers(image, size=None):
+  '''Returns the raw (width, height, rgb, alpha) data of an image, alpha being None for opaque images.
+  Does not need the main thread.
+  
+  Arguments:
+  image --- The decoded wx.Image
+  size --- Maximum size to scale the image down to, keeping its aspect ratio (no scaling if None)
+  
+  '''
+  if size is not None and (image.GetWidth() > size[0] or image.GetHeight() > size[1]):
+    scale = min(size[0] / float(image.GetWidth()), size[1] / float(image.GetHeight()))
+    image = image.Scale(max(1, int(image.GetWidth() * scale)), max(1, int(image.GetHeight() * scale)), wx.IMAGE_QUALITY_HIGH)
+  
+  alpha = None
+  if image.HasAlpha():
+    alpha = image.GetAlphaData()
+  
+  return (image.GetWidth(), image.GetHeight(), image.GetData(), alpha)
+
+
+def bufferBitmap(buffers):
+  '''Creates a bitmap from the raw data returned by imageBuffers, without decoding anything
+  
+  Arguments:
+  buffers --- The (width, height, rgb, alpha) data
+  
+  '''
+  width, height, rgb, alpha = buffers
+  if alpha is None:
+    return wx.BitmapFromBuffer(width, height, rgb)
+  
+  return wx.BitmapFromBuffer(width, height, rgb, alpha)
+
+
+def loadBitmap(path, size=None):
+  '''Loads an image file as bitmap. The decoded and scaled image is cached until the file changes.
+  
+  Arguments:
+  path --- The image file
+  size --- Maximum size to scale the image down to (no scaling if None)
+  
+  '''
+  cache = getCache('assets', os.path.dirname(path))
+  key = '{0}@{1}'.format(path, size)
+  buffers = cache.get(key, statKey(path))
+  if buffers is None:
+    buffers = imageBuffers(wx.Image(path, wx.BITMAP_TYPE_ANY), size)
+    cache.put(key, buffers, statKey(path))
+  
+  return bufferBitmap(buffers)
+
+
+
+class BitmapCache:
+  '''Bounded cache of bitmaps, dropping the least recently used one when full
+  '''
+  
+  def __init__(self, size):
+    '''Creates an empty cache
+    
+    Arguments:
+    size --- Maximum number of bitmaps kept
+    
+    '''
+    self.size = size			#: Maximum number of bitmaps kept
+    self.bitmaps = OrderedDict()	#: Cached bitmaps, least recently used first
+    
+  
+  def get(self, key):
+    '''Returns a cached bitmap, None if it is not cached
+    
+    Arguments:
+    key --- Key of the bitmap
+    
+    '''
+    bitmap = self.bitmaps.pop(key, None)
+    if bitmap is not None:
+      self.bitmaps[key] = bitmap
+    
+    return bitmap
+    
+  
+  def put(self, key, bitmap):
+    '''Adds a bitmap to the cache
+    
+    Arguments:
+    key --- Key of the bitmap
+    bitmap --- The bitmap
+    
+    '''
+    self.bitmaps.pop(key, None)
+    self.bitmaps[key] = bitmap
+    while len(self.bitmaps) > self.size:
+      self.bitmaps.popitem(last=False)
+    
+  
+# END CLASS BitmapCache
+
+
+
+class ModList(wx.ListCtrl, CheckListCtrlMixin):
+  '''List of mods with a checkbox for each mod and additional columns
+  '''
+  
+  def __init__(self, parent, size, columns, onCheck=None):
+    '''Creates a new mod list
+    
+    Arguments:
+    parent --- The parent of the list
+    size --- Size of the list
+    columns --- (title, width) of the columns shown after the mod name, the last one is used for warnings
+    onCheck --- Function called with the index of a mod and whether it is checked when it is checked or unchecked
+    
+    '''
+    wx.ListCtrl.__init__(self, parent, size=size, style=wx.LC_REPORT|wx.LC_SINGLE_SEL|wx.BORDER_SUNKEN)
+    CheckListCtrlMixin.__init__(self)
+    
+    self.onCheck = onCheck	#: Function called when a mod is checked or unchecked
+    
+    # The mod name gets the space the other columns leave
+    self.InsertColumn(0, 'Mod', width=size[0] - sum(width for title, width in columns) - 20)
+    for index in range(0, len(columns) - 1):
+      self.InsertColumn(index + 1, columns[index][0], format=wx.LIST_FORMAT_RIGHT, width=columns[index][1])
+    self.InsertColumn(len(columns), columns[-1][0], width=columns[-1][1])
+    
+  
+  def Clear(self):
+    '''Removes all mods from the list
+    '''
+    self.DeleteAllItems()
+    
+  
+  def Append(self, name):
+    '''Adds a mod to the end of the list
+    
+    Arguments:
+    name --- Name of the mod
+    
+    '''
+    return self.InsertStringItem(self.GetItemCount(), name)
+    
+  
+  def Check(self, index, check=True):
+    '''Checks or unchecks a mod
+    
+    Arguments:
+    index --- Index of the mod
+    check --- Whether to check the mod
+    
+    '''
+    self.CheckItem(index, check)
+    
+  
+  def GetChecked(self):
+    '''Returns the indices of all checked mods
+    '''
+    return [index for index in range(0, self.GetItemCount()) if self.IsChecked(index)]
+    
+  
+  def SetColumns(self, index, texts):
+    '''Sets the additional columns of a mod
+    
+    Arguments:
+    index --- Index of the mod
+    texts --- Text of each additional column
+    
+    '''
+    for column in range(0, len(texts)):
+      self.SetStringItem(index, column + 1, texts[column])
+    
+  
+  def SetWarnings(self, index, warnings):
+    '''Shows the warnings of a mod in the last column and highlights mods with warnings
+    
+    Arguments:
+    index --- Index of the mod
+    warnings --- List of warnings
+    
+    '''
+    self.SetStringItem(index, self.GetColumnCount() - 1, '; '.join(warnings))
+    # Mods without warnings keep the text colour of the theme
+    self.SetItemTextColour(index, wx.RED if len(warnings) > 0 else self.GetTextColour())
+    
+  
+  def OnCheckItem(self, index, flag):
+    '''Called by CheckListCtrlMixin when a mod is checked or unchecked
+    
+    Arguments:
+    index --- Index of the mod
+    flag --- Whether the mod is checked now
+    
+    '''
+    if self.onCheck is not None:
+      self.onCheck(index, flag)
+    
+  
+# END CLASS ModList
+
+
+
+# The main launher window
+class Launcher(wx.Frame):
+  '''The main launcher window
+  '''
+  
+  def __init__(self, parent, title):
+    '''Creates a new launcher window
+    
+    Parameters:
+    parent --- The parent of the window
+    title --- The tile of the window
+    
+    '''
+    wx.Frame.__init__(self, parent, title=title, style=wx.CAPTION|wx.CLOSE_BOX)
+    
+    # Initialize the UI
+    self.initUI()
+    
+    
+  
+  def initUI(self):
+    '''Initializes the UI
+    '''
+    
+    #: The main container for the window
+    self.panel = wx.Panel(self, -1)
+    
+    #: The Sizer for the main window
+    self.box = wx.BoxSizer(wx.VERTICAL)
+    
+    # CK2 logo, decoded only when the image changed
+    logo = wx.StaticBitmap(self.panel, bitmap=loadBitmap(sys.path[0] + '/ck2.png'), size=(-1, 125))
     
     # Labels for the mod and dlc lists
-    labelFont = wx.Font(10, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD)
-    modLabel = wx.StaticText(self.panel, label='Mods:', size=(260, -1))
-    modLabel.SetFont(labelFont)
+    labelFont = getFont(10, wx.FONTWEIGHT_BOLD)
+    
+    # Game install label, selection and sizer
+    gameLabel = wx.StaticText(self.panel, label='Game:', size=(60, -1))
+    gameLabel.SetFont(labelFont)
+    
+    #: The game install selection
+    self.gameChoice = wx.Choice(self.panel, size=(460, -1))
+    self.gameChoice.Bind(wx.EVT_CHOICE, self.gameChoiceSelect)
+    
+    gameSizer = wx.BoxSizer(wx.HORIZONTAL)
+    gameSizer.Add(gameLabel, flag=wx.ALIGN_CENTER_VERTICAL)
+    gameSizer.Add(self.gameChoice, flag=wx.ALIGN_CENTER_VERTICAL)
+    
+    #: Label of the mod list, also shows the load cost of the selected mods
+    self.modLabel = wx.StaticText(self.panel, label='Mods:', size=(760, -1))
+    self.modLabel.SetFont(labelFont)
     dlcLabel = wx.StaticText(self.panel, label='DLC\'s:')
     dlcLabel.SetFont(labelFont)
     labelSizer = wx.BoxSizer(wx.HORIZONTAL)
-    labelSizer.Add(modLabel)
+    labelSizer.Add(self.modLabel)
     labelSizer.Add(dlcLabel)
     
     # Font for the mod and dlc lists
-    listFont = wx.Font(8, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
+    listFont = getFont(8)
     
-    #: The mod list
-    self.modList = wx.CheckListBox(self.panel, size=(260, 200), style=wx.LC_REPORT|wx.BORDER_SUNKEN)
+    #: The mod list, with the load cost and compatibility warnings of each mod
+    self.modList = ModList(self.panel, (760, 200), [(title, 68) for title in LOADCOST_TITLES] + [('Warnings', 200)], self.modChecked)
     self.modList.SetFont(listFont)
+    self.modList.Bind(wx.EVT_LIST_ITEM_SELECTED, self.modSelected)
     
     #: The DLC list
     self.dlcList = wx.CheckListBox(self.panel, size=(260, 200), style=wx.LC_REPORT|wx.BORDER_SUNKEN)
     self.dlcList.SetFont(listFont)
+    self.dlcList.Bind(wx.EVT_CHECKLISTBOX, self.dlcChecked)
     
     #: Sizer for the mod and dlc lists
     self.listSizer = wx.BoxSizer(wx.HORIZONTAL)
     self.listSizer.Add(self.modList)
     self.listSizer.Add(self.dlcList)
     
+    #: Thumbnail of the mod selected in the mod list
+    self.thumbnail = wx.StaticBitmap(self.panel, size=THUMBNAIL_SIZE)
+    self.listSizer.Add(self.thumbnail, flag=wx.ALIGN_CENTER_VERTICAL)
+    
+    #: Decoded mod thumbnails: mod path -> bitmap, wx.NullBitmap if the picture could not be read
+    self.thumbnails = BitmapCache(THUMBNAIL_CACHE_SIZE)
+    
+    #: The mod whose thumbnail the thumbnail thread decodes next, None if there is nothing to do
+    self.thumbnailRequest = None
+    
+    #: Wakes the thumbnail thread, guards thumbnailRequest
+    self.thumbnailCondition = threading.Condition()
+    
+    # A single thread decodes the thumbnails, selections made while it is busy only keep the last one
+    thread = threading.Thread(target=self.thumbnailWorker)
+    thread.daemon = True
+    thread.start()
+    
+    #: The configuration window, created when first opened
+    self.confFrame = None
+    
     # Horizontal sizer to hold the Configuration and Run buttons
     buttonBox = wx.BoxSizer(wx.HORIZONTAL)
     
@@ -345,14 +1390,20 @@ class Launcher(wx.Frame):
     self.confButton = wx.Button(self.panel, label='&Configuration', size=(150, 30))
     self.confButton.Bind(wx.EVT_BUTTON, self.confButtonClick)
     
+    #: History button
+    self.historyButton = wx.Button(self.panel, label='&History', size=(150, 30))
+    self.historyButton.Bind(wx.EVT_BUTTON, self.historyButtonClick)
+    
     #: Run Button
     self.runButton = wx.Button(self.panel, label='&Run CK2', size=(150, 30))
     self.runButton.Bind(wx.EVT_BUTTON, self.runButtonClick)
     
     # Add controls to sizer
+    buttonBox.Add(self.historyButton)
     buttonBox.Add(self.confButton)
     buttonBox.Add(self.runButton)
     self.box.Add(logo, flag=wx.ALIGN_CENTER)
+    self.box.Add(gameSizer, flag=wx.ALIGN_CENTER)
     self.box.Add(labelSizer, flag=wx.ALIGN_CENTER)
     self.box.Add(self.listSizer)
     self.box.Add(buttonBox, flag=wx.ALIGN_RIGHT)
@@ -362,9 +1413,15 @@ class Launcher(wx.Frame):
     # Bind the frame close event to its event handler
     self.Bind(wx.EVT_CLOSE, self.frameClose)
     
+    #: The running game session, None if no game is running
+    self.session = None
+    
+    #: Timer checking whether the running game has exited or finished loading
+    self.gameTimer = wx.Timer(self)
+    self.Bind(wx.EVT_TIMER, self.gameTimerTick, self.gameTimer)
+    
     # Load mods and DLC's into their respective lists
-    self.loadMods()
-    self.loadDlcs()
+    self.reload()
     
     # Fit all elements in the window
     self.box.Fit(self)
@@ -374,6 +1431,16 @@ class Launcher(wx.Frame):
     
     
     
+  # Loads the mod and dlc lists
+  def reload(self):
+    '''Scans all mods and game installs and loads them into the lists of the main launcher window
+    '''
+    self.loadMods()
+    self.loadDlcs()
+    self.analyzeLoadCosts()
+    writeMetrics('scan')
+    
+  
   # Loads the mod list
   def loadMods(self):
     '''Loads the mod list of the main laucher window
@@ -383,7 +1450,10 @@ class Launcher(wx.Frame):
     
     # Detect mods
     okMsg('Detecting mods...')
-    self.mods = detectMods()		#: List of mods available in the mod directory
+    self.mods = detectMods()		#: List of mods available in the mod roots
+    self.modIndex = dict((self.mods[index], index) for index in range(0, len(self.mods)))	#: Mod -> index in the mod list
+    self.costs = None			#: Load cost of each mod, None until analyzed
+    self.compatibility = None		#: Compatibility of the mods, None until the game installs are scanned
     okMsg('Done. Found {0} mods'.format(str(len(self.mods))))
     
     # Get list of mods that were checked last time (if available)
@@ -395,23 +1465,48 @@ class Launcher(wx.Frame):
     self.modList.Clear()
     count = 0
     for mod in self.mods:
-      self.modList.Append(mod.name)
-      if mod.filename in checkedMods:
+      if mod.isLocal():
+	self.modList.Append(mod.name)
+      else:
+	# Tag mods from other roots with their source
+	self.modList.Append('{0} [{1}]'.format(mod.name, os.path.basename(os.path.normpath(mod.source))))
+      if mod.isSelectedIn(checkedMods):
 	self.modList.Check(count, True)
 	
       count += 1
       
   
-  # Loads the dlc list
+  # Loads the game installs and their dlc lists
   def loadDlcs(self):
-    '''Loads the list of DLC's in the main window
+    '''Detects all game installs and loads the list of DLC's of the selected one in the main window
     '''
     
     global config
     
-    okMsg('Detecting DLC\'s...')
-    self.dlcs = detectDlcs()		#: List of available DLC's in the dlc directory
-    okMsg('Done. Found {0} DLC\'s'.format(str(len(self.dlcs))))
+    okMsg('Detecting game installs and DLC\'s...')
+    self.installs = detectGameInstalls()	#: List of configured game installs
+    okMsg('Done. Found {0} game installs'.format(str(len(self.installs))))
+    
+    # Insert all installs into the game selection and select the configured one
+    self.gameChoice.Clear()
+    selected = 0
+    for index in range(0, len(self.installs)):
+      self.gameChoice.Append(self.installs[index].label())
+      if os.path.abspath(self.installs[index].path) == os.path.abspath(config.get('launcher', 'gamepath')):
+	selected = index
+    
+    self.gameChoice.SetSelection(selected)
+    self.showDlcs()
+    
+  
+  # Shows the dlc list of the selected game install
+  def showDlcs(self):
+    '''Loads the list of DLC's of the selected game install, without scanning it again
+    '''
+    
+    global config
+    
+    self.dlcs = self.installs[self.gameChoice.GetSelection()].dlcs	#: List of available DLC's of the selected game install
     
     # Get dlcs that where checked on the last run, if not defined check all
     checkAll = True
@@ -430,118 +1525,352 @@ class Launcher(wx.Frame):
       
       count += 1
     
+    # The game version and DLC's changed, compute the compatibility of all mods again
+    self.compatibility = Compatibility(self.mods, self.installs[self.gameChoice.GetSelection()], self.enabledDlcs(), self.selectedMods())
+    self.showWarnings(self.mods)
+    
     
   
-  def confButtonClick(self, event):
-    '''Event handler for the configuration button click event
+  def showWarnings(self, mods):
+    '''Shows the compatibility warnings of the mods in the mod list
     
     Arguments:
-    event --- Button click event
+    mods --- The mods whose warnings changed
     
     '''
-    confFrame = Configuration(self)
-    confFrame.MakeModal(True)
-    confFrame.Show()
+    for mod in mods:
+      self.modList.SetWarnings(self.modIndex[mod], self.compatibility.warnings(mod))
+    
     
   
-  
-  def frameClose(self, event):
-    '''Event hanler for the frame close event
+  def modSelected(self, event):
+    '''Event handler for the mod list selection event, shows the thumbnail of the selected mod
     
     Arguments:
-    event --- Frame close event
+    event --- List item selected event
     
     '''
-    global config
+    mod = self.mods[event.GetIndex()]
+    bitmap = self.thumbnails.get(mod.path)
+    if bitmap is not None or mod.picture is None:
+      self.showThumbnail(bitmap)
+      return
     
-    # Save all selected mods
-    selectedMods = []
-    for index in self.modList.GetChecked():
-      selectedMods.append(self.mods[index].filename)
+    # Read and decode the picture in the background, only the bitmap is created on the main thread
+    self.showThumbnail(None)
+    with self.thumbnailCondition:
+      self.thumbnailRequest = mod
+      self.thumbnailCondition.notify()
+    
+    
+  
+  def thumbnailWorker(self):
+    '''Reads and decodes the requested mod thumbnails, runs in its own thread
+    '''
+    while True:
+      with self.thumbnailCondition:
+	while self.thumbnailRequest is None:
+	  self.thumbnailCondition.wait()
+	mod = self.thumbnailRequest
+	self.thumbnailRequest = None
       
-    config.set('launcher', 'selectedMods', ','.join(selectedMods))
+      data = mod.readPicture()
+      buffers = None
+      if data is not None:
+	image = wx.ImageFromStream(cStringIO.StringIO(data), wx.BITMAP_TYPE_ANY)
+	if image.IsOk():
+	  buffers = imageBuffers(image, THUMBNAIL_SIZE)
+      wx.CallAfter(self.thumbnailDecoded, mod, buffers)
+    
+    
+  
+  def thumbnailDecoded(self, mod, buffers):
+    '''Caches a decoded mod thumbnail and shows it if its mod is still selected
+    
+    Arguments:
+    mod --- The mod of the thumbnail
+    buffers --- The decoded thumbnail as returned by imageBuffers, None if it could not be decoded
+    
+    '''
+    if buffers is None:
+      # Remember the failure, so the picture is not read again each time the mod is selected
+      infoMsg('Could not read picture "{0}" of mod "{1}"'.format(mod.picture, mod.name))
+      bitmap = wx.NullBitmap
+    else:
+      bitmap = bufferBitmap(buffers)
+    
+    self.thumbnails.put(mod.path, bitmap)
+    
+    selected = self.modList.GetFirstSelected()
+    if selected != -1 and self.mods[selected] is mod:
+      self.showThumbnail(bitmap)
+    
+    
+  
+  def showThumbnail(self, bitmap):
+    '''Shows a mod thumbnail next to the lists
+    
+    Arguments:
+    bitmap --- The thumbnail, None to clear it
+    
+    '''
+    if bitmap is None:
+      bitmap = wx.NullBitmap
+    
+    self.thumbnail.SetBitmap(bitmap)
+    
+    
+  
+  def modChecked(self, index, checked):
+    '''Called by the mod list when a mod is checked or unchecked
+    
+    Arguments:
+    index --- Index of the mod
+    checked --- Whether the mod is checked now
+    
+    '''
+    self.showSelectedCost()
+    
+    if self.compatibility is not None:
+      self.showWarnings(self.compatibility.setModSelected(self.mods[index], checked))
+    
+    
+  
+  def dlcChecked(self, event):
+    '''Event handler for the dlc list check event
+    
+    Arguments:
+    event --- The check event
+    
+    '''
+    index = event.GetInt()
+    self.showWarnings(self.compatibility.setDlcEnabled(self.dlcs[index], self.dlcList.IsChecked(index)))
+    
+    
+  
+  def saveSelectedDlcs(self):
+    '''Stores the checked DLC's of the dlc list in the configuration
+    '''
+    global config
     
-    # Save all selected dlc
     selectedDlcs = []
     for index in self.dlcList.GetChecked():
       selectedDlcs.append(self.dlcs[index].filename)
     
     config.set('launcher', 'selecteddlcs', ','.join(selectedDlcs))
     
-    config.write(open(CONFIG_FILE, 'w'))
-    
-    # Continue closing frame
-    event.Skip()
-  
   
   
-  def runButtonClick(self, event):
-    '''Event handler for the run button click event
+  def gameChoiceSelect(self, event):
+    '''Event handler for the game selection event
     
     Arguments:
-    event --- The click event
+    event --- Choice event
     
     '''
-    global config, ck2Process
+    global config
     
-    # Get selected mods from list
-    selectedMods = []
-    for index in self.modList.GetChecked():
-      selectedMods.append(self.mods[index])
+    # Keep the DLC selection and switch to the already scanned install
+    self.saveSelectedDlcs()
+    install = self.installs[self.gameChoice.GetSelection()]
+    config.set('launcher', 'gamepath', install.path)
+    infoMsg('Selected game version {0} in "{1}".'.format(install.version, install.path))
+    self.showDlcs()
     
-    # Prepare command to execute
-    command = []
-    if len(config.get('launcher', 'prepend').strip()) > 0:
-      command = config.get('launcher', 'prepend').split(' ')
-    command.append(config.get('launcher', 'gamepath') + '/' + config.get('launcher', 'gamebinary'))
+    # Mods override the files of the selected install
+    self.analyzeLoadCosts()
     
-    # Decide which mods to load
-    if (len(selectedMods) == 0):
+    
+  
+  def analyzeLoadCosts(self):
+    '''Computes the load cost of all mods in the background and shows it in the mod list when done
+    '''
+    mods = self.mods
+    install = self.installs[self.gameChoice.GetSelection()]
+    
+    def analyze():
+      costs = analyzeMods(mods, install)
+      wx.CallAfter(self.showLoadCosts, mods, costs)
+    
+    thread = threading.Thread(target=analyze)
+    thread.daemon = True
+    thread.start()
+    
+    
+  
+  def showLoadCosts(self, mods, costs):
+    '''Shows the load cost of each mod in the mod list
+    
+    Arguments:
+    mods --- The analyzed mods
+    costs --- Load cost of each mod
+    
+    '''
+    # Window closed or mod list reloaded in the meantime
+    if not self or mods is not self.mods:
+      return
+    
+    self.costs = costs
+    for index in range(0, len(costs)):
+      self.modList.SetColumns(index, costs[index].columns())
+    
+    self.showSelectedCost()
+    
+    
+  
+  def showSelectedCost(self):
+    '''Shows the total load cost of the selected mods in the mod list label
+    '''
+    if self.costs is None:
+      self.modLabel.SetLabel('Mods:')
+      return
+    
+    total = LoadCost()
+    checked = self.modList.GetChecked()
+    for index in checked:
+      total.add(self.costs[index])
+    
+    self.modLabel.SetLabel('Mods: {0} selected, {1} files, {2} ({3} textures, {4} scripts), {5} overrides'.format(
+	len(checked), total.files, formatBytes(total.bytes), formatBytes(total.textureBytes), formatBytes(total.scriptBytes), total.overrides))
+    
+    
+  
+  def confButtonClick(self, event):
+    '''Event handler for the configuration button click event
+    
+    Arguments:
+    event --- Button click event
+    
+    '''
+    # The configuration window is only hidden when closed, so it is built once
+    if self.confFrame is None:
+      self.confFrame = Configuration(self)
+    else:
+      self.confFrame.loadValues()
+    
+    self.confFrame.MakeModal(True)
+    self.confFrame.Show()
+    
+  
+  
+  def historyButtonClick(self, event):
+    '''Event handler for the history button click event
+    
+    Arguments:
+    event --- Button click event
+    
+    '''
+    historyFrame = History(self, sortMods(self.selectedMods()), self.enabledDlcs())
+    historyFrame.MakeModal(True)
+    historyFrame.Show()
+    
+  
+  
+  def selectedMods(self):
+    '''Returns the checked mods
+    '''
+    return [self.mods[index] for index in self.modList.GetChecked()]
+    
+  
+  
+  def enabledDlcs(self):
+    '''Returns the checked DLC's
+    '''
+    return [self.dlcs[index] for index in self.dlcList.GetChecked()]
+  
+  
+  
+  def frameClose(self, event):
+    '''Event hanler for the frame close event
+    
+    Arguments:
+    event --- Frame close event
+    
+    '''
+    self.saveSelection()
+    
+    # Continue closing frame
+    event.Skip()
+  
+  
+  
+  def saveSelection(self):
+    '''Saves the selected mods and DLC's and the scan results
+    '''
+    global config
+    
+    # Save all selected mods by their full path, the same modfile name may be used in several roots
+    selectedMods = []
+    for index in self.modList.GetChecked():
+      selectedMods.append(os.path.abspath(self.mods[index].path))
+      
+    config.set('launcher', 'selectedMods', ','.join(selectedMods))
+    
+    # Save all selected dlc
+    self.saveSelectedDlcs()
+    
+    config.write(open(CONFIG_FILE, 'w'))
+    
+    # Keep the scan results for the next start
+    saveCaches()
+  
+  
+  
+  def runButtonClick(self, event):
+    '''Event handler for the run button click event
+    
+    Arguments:
+    event --- The click event
+    
+    '''
+    global config, ck2Process
+    
+    clicked = time.time()
+    
+    # Get selected mods from list
+    selectedMods = self.selectedMods()
+    sortedMods = []
+    
+    # Decide which mods to load
+    if (len(selectedMods) == 0):
       # No mods selected, run vanilla game
       okMsg("No mod selected, running vanilla game...")
+      setMetric('ck2launcher_resolve_duration_seconds', 0)
     else:
-      # Append selected mods to command
+      # Put selected mods in load order
       okMsg(str(len(selectedMods)) + " mods selected:")
-      # Figure out the dependencies of the mods (if any)
-      # Step 1: force them in the format toposort2 expects (a dictionary where
-      # the key is what the value(s) depend on)
-      # Step 2: apply toposort2
-      # Step 3: get the order back based on the names
-      # BTW: this assumes no duplicate names
-      hashedMods = dict()
-      for mod in selectedMods:
-        if mod.dependencies:
-          for dep in mod.dependencies:
-            if dep in hashedMods:
-              hashedMods[dep].add(mod.name)
-            else:
-              hashedMods[dep] = set([mod.name])
-        if mod.name not in hashedMods:
-          hashedMods[mod.name] = set([])
-      sortednames = [item for sublist in toposort2(hashedMods) for item in sublist]
-      sortedMods = []
-      for modName in sortednames:
-        for mod in selectedMods[:]:
-          if mod.name == modName:
-            sortedMods.append(mod)
-            selectedMods.remove(mod)
-            break
+      sortedMods = sortMods(selectedMods)
+      setMetric('ck2launcher_resolve_duration_seconds', time.time() - clicked)
 
       for mod in sortedMods:
         okMsg('\t{0} ({1})'.format(mod.name, mod.filename))
-        command.append('-mod=mod/' + mod.filename)
+        for warning in self.compatibility.warnings(mod):
+          infoMsg('\t  WARNING: {0}'.format(warning))
+      
+      # Check the scripts of the selected mods before the long game load
+      if config.getboolean('launcher', 'validatescripts') and not self.validateScripts(sortedMods):
+        return
+      
+      # Check the textures of the selected mods fit into video memory
+      if config.getint('launcher', 'vrambudget') > 0 and not self.checkVram(sortedMods):
+        return
+    
+    # The launch latency does not include the time spent answering the dialogs of the checks
+    launching = time.time()
 	
     # Exclude unchecked DLC's
+    excludedDlcs = []
     for index in range(0, len(self.dlcs)):
       if not self.dlcList.IsChecked(index):
 	# This dlc is not checked, exclude it
 	infoMsg('Excluding unchecked DLC "{0}".'.format(self.dlcs[index].name))
-	command.append('-exclude_dlc=dlc/' + self.dlcs[index].filename)
+	excludedDlcs.append(self.dlcs[index])
     
     # Execute prepared command
+    command = buildCommand(sortedMods, excludedDlcs)
     infoMsg('Running "{0}"...'.format(' '.join(command)))
     try:
-      ck2Process = Popen(command)
+      ck2Process = Popen(command, cwd=config.get('launcher', 'gamepath'))
       okMsg('Done. Have fun! :D')
     except OSError:
       # Failure, executable not found
@@ -551,7 +1880,112 @@ class Launcher(wx.Frame):
       # Return to launcher
       return
     
-    self.Close()
+    # Measure how long the game takes to load
+    self.session = GameSession(ck2Process, sortedMods, self.enabledDlcs(), self.installs[self.gameChoice.GetSelection()].version)
+    setMetric('ck2launcher_selected_mods', len(sortedMods))
+    setMetric('ck2launcher_launch_latency_seconds', self.session.started - launching)
+    writeMetrics('launch')
+    
+    # Stay resident while the game runs, the loaded mods and DLC's are reused afterwards
+    self.saveSelection()
+    self.Hide()
+    self.gameTimer.Start(GAME_POLL_INTERVAL)
+     
+  
+  
+  def validateScripts(self, mods):
+    '''Validates the scripts of the mods, returns whether the game should be started
+    
+    Arguments:
+    mods --- The mods to validate
+    
+    '''
+    busy = wx.BusyCursor()
+    report = validateMods(mods)
+    del busy
+    
+    if len(report) == 0:
+      okMsg('No script problems found.')
+      return True
+    
+    for mod, filename, line, problem in report:
+      infoMsg('{0}:{1}: {2}'.format(filename, line, problem))
+    
+    # Show the first problems and let the user decide
+    shown = '\n'.join('{0}:{1}: {2}'.format(filename, line, problem) for mod, filename, line, problem in report[:VALIDATE_SHOWN])
+    if len(report) > VALIDATE_SHOWN:
+      shown += '\n... (see {0})'.format(LOGFILE)
+    
+    dialog = wx.MessageDialog(self, 'Found {0} script problems in the selected mods:\n\n{1}\n\nRun CK2 anyway?'.format(len(report), shown),
+			      APPNAME, wx.YES_NO | wx.NO_DEFAULT | wx.ICON_WARNING)
+    return dialog.ShowModal() == wx.ID_YES
+     
+  
+  
+  def checkVram(self, mods):
+    '''Estimates the video memory needed by the textures of the mods, returns whether the game should be started
+    
+    Arguments:
+    mods --- The mods to check
+    
+    '''
+    global config
+    
+    busy = wx.BusyCursor()
+    estimates = estimateVram(mods)
+    del busy
+    
+    budget = config.getint('launcher', 'vrambudget') * 1024 * 1024
+    total = sum(size for textures, size in estimates)
+    infoMsg('Estimated texture memory of the selected mods: {0} (budget {1}).'.format(formatBytes(total), formatBytes(budget)))
+    if total <= budget:
+      return True
+    
+    # Show the largest mods and let the user decide
+    largest = sorted(zip(mods, estimates), key=lambda pair: pair[1][1], reverse=True)[:VALIDATE_SHOWN]
+    shown = '\n'.join('{0}: {1} in {2} textures'.format(mod.name, formatBytes(size), textures) for mod, (textures, size) in largest if size > 0)
+    
+    dialog = wx.MessageDialog(self, 'The textures of the selected mods need an estimated {0} of video memory, the budget is {1}:\n\n{2}\n\nRun CK2 anyway?'
+			      .format(formatBytes(total), formatBytes(budget), shown), APPNAME, wx.YES_NO | wx.NO_DEFAULT | wx.ICON_WARNING)
+    return dialog.ShowModal() == wx.ID_YES
+     
+  
+  
+  def gameTimerTick(self, event):
+    '''Event handler for the game timer event, returns to the launcher once the game exited
+    
+    Arguments:
+    event --- The timer event
+    
+    '''
+    global ck2Process
+    
+    exitCode = self.session.poll()
+    if exitCode is None:
+      # Game still running
+      return
+    
+    self.gameTimer.Stop()
+    ck2Process = None
+    
+    # Keep the load time for the history
+    if self.session.readyAfter is None:
+      infoMsg('Game exited before it finished loading.')
+    recordSession(self.session)
+    self.session.setMetrics()
+    writeMetrics('exit')
+    self.session = None
+    
+    # Back to the launcher
+    self.Show()
+    self.Raise()
+    
+    if exitCode == 0:
+      # Game closed correctly
+      okMsg('Game closed without error.')
+    else:
+      # Something went wrong
+      errorMsg('Process closed with error code {0}. Please check configuration.'.format(str(exitCode)), self)
      
     
 # END CLASS Launcher
@@ -583,7 +2017,7 @@ class Configuration(wx.Frame):
     self.panel.SetSizer(self.vsizer)
     
     # Default font for the labels
-    labelFont = wx.Font(10, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD)
+    labelFont = getFont(10, wx.FONTWEIGHT_BOLD)
     
     # Game path label, input, choose button and sizer
     gpSizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -591,7 +2025,7 @@ class Configuration(wx.Frame):
     gpLabel.SetFont(labelFont)
     
     #: Input field for the game path
-    self.gpInput = wx.TextCtrl(self.panel, value=config.get('launcher', 'gamepath'), size=(325, -1))
+    self.gpInput = wx.TextCtrl(self.panel, size=(325, -1))
     
     #: Button to open the directory dialog for the game path
     self.gpChooseBtn = wx.Button(self.panel, label='Choose folder...')
@@ -609,7 +2043,7 @@ class Configuration(wx.Frame):
     mpLabel.SetFont(labelFont)
     
     #: Input field for the mod path
-    self.mpInput = wx.TextCtrl(self.panel, value=config.get('launcher', 'modpath'), size=(325, -1))
+    self.mpInput = wx.TextCtrl(self.panel, size=(325, -1))
     
     #: Button to open the directory dialog for the mod path
     self.mpChooseBtn = wx.Button(self.panel, label='Choose folder...')
@@ -621,13 +2055,33 @@ class Configuration(wx.Frame):
     # Connect mod path choose button click event to handler
     self.mpChooseBtn.Bind(wx.EVT_BUTTON, self.mpChooseBtnClick)
     
+    # Extra mod paths label, input and sizer
+    emSizer = wx.BoxSizer(wx.HORIZONTAL)
+    emLabel = wx.StaticText(self.panel, label=' Extra mod paths:', size=(160, -1))
+    emLabel.SetFont(labelFont)
+    
+    #: Input field for the extra mod roots (Steam Workshop content, ...), separated by os.pathsep
+    self.emInput = wx.TextCtrl(self.panel, size=(435, -1))
+    emSizer.Add(emLabel, flag=wx.ALIGN_CENTER_VERTICAL)
+    emSizer.Add(self.emInput, flag=wx.ALIGN_CENTER_VERTICAL)
+    
+    # Game installs label, input and sizer
+    giSizer = wx.BoxSizer(wx.HORIZONTAL)
+    giLabel = wx.StaticText(self.panel, label=' Game installs:', size=(160, -1))
+    giLabel.SetFont(labelFont)
+    
+    #: Input field for the game installs to choose from, separated by os.pathsep
+    self.giInput = wx.TextCtrl(self.panel, size=(435, -1))
+    giSizer.Add(giLabel, flag=wx.ALIGN_CENTER_VERTICAL)
+    giSizer.Add(self.giInput, flag=wx.ALIGN_CENTER_VERTICAL)
+    
     # Game binary label, input and sizer
     gbSizer = wx.BoxSizer(wx.HORIZONTAL)
     gbLabel = wx.StaticText(self.panel, label=' Game binary:', size=(160, -1))
     gbLabel.SetFont(labelFont)
     
     #: The input field for the binary name
-    self.gbInput = wx.TextCtrl(self.panel, value=config.get('launcher', 'gamebinary'), size=(435, -1))
+    self.gbInput = wx.TextCtrl(self.panel, size=(435, -1))
     
     gbSizer.Add(gbLabel, flag=wx.ALIGN_CENTER_VERTICAL)
     gbSizer.Add(self.gbInput, flag=wx.ALIGN_CENTER_VERTICAL)
@@ -638,7 +2092,7 @@ class Configuration(wx.Frame):
     ppLabel.SetFont(labelFont)
     
     #: Input field for the prepended commands
-    self.ppInput = wx.TextCtrl(self.panel, value=config.get('launcher', 'prepend'), size=(435, -1))
+    self.ppInput = wx.TextCtrl(self.panel, size=(435, -1))
     ppSizer.Add(ppLabel, flag=wx.ALIGN_CENTER_VERTICAL)
     ppSizer.Add(self.ppInput, flag=wx.ALIGN_CENTER_VERTICAL)
     
@@ -656,6 +2110,8 @@ class Configuration(wx.Frame):
     # Add ui elements to frame sizer
     self.vsizer.Add(gpSizer)
     self.vsizer.Add(mpSizer)
+    self.vsizer.Add(emSizer)
+    self.vsizer.Add(giSizer)
     self.vsizer.Add(gbSizer)
     self.vsizer.Add(ppSizer)
     self.vsizer.Add(buttonSizer, flag=wx.ALIGN_RIGHT)
@@ -663,20 +2119,44 @@ class Configuration(wx.Frame):
     # Fit all elements into the configuration window
     self.vsizer.Fit(self)
     
+    # Fill in the configuration
+    self.loadValues()
+    
     # Center configuration window on screen
     self.Centre()
     
   
   
+  def loadValues(self):
+    '''Fills the input fields with the current configuration
+    '''
+    global config
+    
+    self.gpInput.SetValue(config.get('launcher', 'gamepath'))
+    self.mpInput.SetValue(config.get('launcher', 'modpath'))
+    self.emInput.SetValue(config.get('launcher', 'extramodpaths'))
+    self.giInput.SetValue(config.get('launcher', 'gamepaths'))
+    self.gbInput.SetValue(config.get('launcher', 'gamebinary'))
+    self.ppInput.SetValue(config.get('launcher', 'prepend'))
+    
+  
+  
   def frameClose(self, event):
-    '''Event handler for the frame close event
+    '''Event handler for the frame close event, only hides the window so it can be shown again quickly
     
     Arguments:
     event --- The close event
     
     '''
     self.MakeModal(False)
-    event.Skip()
+    
+    # Let the window be destroyed if closing can not be stopped (the launcher itself is closing)
+    if not event.CanVeto():
+      event.Skip()
+      return
+    
+    event.Veto()
+    self.Hide()
     
   
   
@@ -740,16 +2220,27 @@ class Configuration(wx.Frame):
       errorMsg('Mod path "{0}" does not exist!'.format(self.mpInput.GetValue()), self)
       return
     
+    for path in splitPaths(self.emInput.GetValue()):
+      if not os.path.exists(path):
+	errorMsg('Extra mod path "{0}" does not exist!'.format(path), self)
+	return
+    
+    for path in splitPaths(self.giInput.GetValue()):
+      if not os.path.isfile(path + '/' + self.gbInput.GetValue()):
+	errorMsg('Game binary "{0}" not found in "{1}"!'.format(self.gbInput.GetValue(), path), self)
+	return
+    
     # Change configuration and save
     config.set('launcher', 'gamepath', self.gpInput.GetValue())
     config.set('launcher', 'modpath', self.mpInput.GetValue())
+    config.set('launcher', 'extramodpaths', self.emInput.GetValue())
+    config.set('launcher', 'gamepaths', self.giInput.GetValue())
     config.set('launcher', 'prepend', self.ppInput.GetValue())
     config.set('launcher', 'gamebinary', self.gbInput.GetValue())
     config.write(open(CONFIG_FILE, 'w'))
     
     # Configuration may have changed, reload mod and dlc list
-    self.Parent.loadMods()
-    self.Parent.loadDlcs()
+    self.Parent.reload()
     
     # Close configuration window
     self.Close()
@@ -758,72 +2249,1320 @@ class Configuration(wx.Frame):
 # END CLASS Configuration
 
 
-def detectMods():
-  '''Detects all available mods in the mod directory
+
+class History(wx.Frame):
+  '''Load time history window
   '''
-  global config, launcher
+  def __init__(self, parent, mods, dlcs, title='{0} - Load time history'.format(APPNAME)):
+    '''Creates a new history window
+    
+    Arguments:
+    parent --- The parent of the window
+    mods --- The mods whose history is shown, in load order
+    dlcs --- The enabled DLC's whose history is shown
+    title --- The title of the window
+    
+    '''
+    wx.Frame.__init__(self, parent, title=title, style=wx.CAPTION|wx.CLOSE_BOX|wx.FRAME_FLOAT_ON_PARENT)
+    self.initUI(mods, dlcs)
+    
   
-  # Go into mod directory
-  try:
-    os.chdir(config.get('launcher', 'modpath'))
-  except OSError:
-    # The mod directory does not exist
-    errorMsg('Could not find mod directory "{0}". Please check configuration.'.format(config.get('launcher', 'modpath')), launcher)
-    return []
+  
+  def initUI(self, mods, dlcs):
+    '''Initializes the UI
+    
+    Arguments:
+    mods --- The mods whose history is shown, in load order
+    dlcs --- The enabled DLC's whose history is shown
+    
+    '''
+    # Connect frame close event to handler
+    self.Bind(wx.EVT_CLOSE, self.frameClose)
+    
+    self.panel = wx.Panel(self, -1)		#: The main container panel
+    self.vsizer = wx.BoxSizer(wx.VERTICAL)	#: The main container sizer
+    self.panel.SetSizer(self.vsizer)
+    
+    labelFont = getFont(10, wx.FONTWEIGHT_BOLD)
+    label = wx.StaticText(self.panel, label=' {0} mods, {1} DLC\'s:'.format(len(mods), len(dlcs)))
+    label.SetFont(labelFont)
+    
+    #: List of the game sessions with the selected mods and DLC's
+    self.sessionList = wx.ListCtrl(self.panel, size=(600, 300), style=wx.LC_REPORT|wx.BORDER_SUNKEN)
+    for index in range(0, len(HISTORY_TITLES)):
+      self.sessionList.InsertColumn(index, HISTORY_TITLES[index], width=[130, 80, 80, 80, 70, 140][index])
+    
+    try:
+      sessions = loadHistory(modSetChecksum(mods), dlcSetChecksum(dlcs))
+    except sqlite3.Error, error:
+      errorMsg('Unable to read load time history: {0}'.format(error), self)
+      sessions = []
+    
+    # Newest session first
+    for session in reversed(sessions):
+      columns = historyColumns(session)
+      index = self.sessionList.InsertStringItem(self.sessionList.GetItemCount(), columns[0])
+      for column in range(1, len(columns)):
+	self.sessionList.SetStringItem(index, column, columns[column])
+      if 'regression' in session[5]:
+	self.sessionList.SetItemTextColour(index, wx.RED)
+    
+    #: Close button
+    self.closeButton = wx.Button(self.panel, label='&Close')
+    self.closeButton.Bind(wx.EVT_BUTTON, self.closeButtonClick)
+    
+    self.vsizer.Add(label)
+    self.vsizer.Add(self.sessionList)
+    self.vsizer.Add(self.closeButton, flag=wx.ALIGN_RIGHT)
+    
+    # Fit all elements into the history window
+    self.vsizer.Fit(self)
+    
+    # Center history window on screen
+    self.Centre()
+    
+  
+  
+  def frameClose(self, event):
+    '''Event handler for the frame close event
+    
+    Arguments:
+    event --- The close event
+    
+    '''
+    self.MakeModal(False)
+    event.Skip()
+    
+  
+  
+  def closeButtonClick(self, event):
+    '''Event handler for the close button click event
+    
+    Arguments:
+    event --- The click event
+    
+    '''
+    self.Close()
+  
+  
+# END CLASS History
+
+
+def modRoots():
+  '''Returns all configured mod roots, starting with the local mod folder
+  '''
+  global config
+  
+  roots = []
+  for root in [config.get('launcher', 'modpath')] + splitPaths(config.get('launcher', 'extramodpaths')):
+    if os.path.abspath(root) not in [os.path.abspath(known) for known in roots]:
+      roots.append(root)
+  
+  return roots
+
+# END modRoots()
+
+
+
+def scanModRoot(root):
+  '''Reads all modfiles of a mod root, using the cache partition of the root.
+  Runs in a scanner thread, so it must not show any dialogs.
+  
+  Returns a list of (filename, content) tuples, None if the root does not exist.
+  
+  Arguments:
+  root --- The mod root to scan
+  
+  '''
+  if not os.path.isdir(root):
+    return None
+  
+  cache = getCache('mods', root)
   
   # Search modfiles
-  modfiles = glob.glob('*.mod')
+  modfiles = []
+  for pattern in MOD_PATTERNS:
+    modfiles.extend(sorted(glob.glob(os.path.join(root, pattern))))
+  
+  # The modfiles written for mods from other roots are not mods of their own
+  modfiles = [path for path in modfiles if not os.path.basename(path).startswith(GENERATED_PREFIX)]
+  
+  # Only read modfiles that changed since the last scan
+  found = []
+  for path in modfiles:
+    moddata = cache.get(path)
+    if moddata is None:
+      moddata = readFile(path)
+      if moddata is not None:
+	cache.put(path, moddata)
+    
+    found.append((os.path.relpath(path, root), moddata))
+  
+  cache.prune(modfiles)
+  return found
+
+# END scanModRoot()
+
+
+
+def detectMods():
+  '''Detects all available mods in the configured mod roots
+  '''
+  global config, launcher
+  
+  # Scan all mod roots at the same time
+  started = time.time()
+  roots = modRoots()
+  results = scanRoots(roots, scanModRoot)
   
-  # Create mod object for each found modfile
+  # Create mod object for each found modfile, the first root a mod is found in wins
   mods = []
-  for modfile in modfiles:
-    mod = Mod(modfile)
-    mods.append(mod)
-    infoMsg('Found mod "{0}" in file "{1}".'.format(mod.name, mod.filename))
+  seen = {}
+  for root, found in zip(roots, results):
+    if found is None:
+      # The mod directory does not exist
+      errorMsg('Could not find mod directory "{0}". Please check configuration.'.format(root), launcher)
+      continue
+    
+    for modfile, moddata in found:
+      mod = Mod(modfile, root, moddata)
+      if mod.identity() in seen:
+	infoMsg('Skipping mod "{0}" in "{1}", already found in "{2}".'.format(mod.name, mod.path, seen[mod.identity()].path))
+	continue
+      
+      seen[mod.identity()] = mod
+      mods.append(mod)
+      infoMsg('Found mod "{0}" in file "{1}".'.format(mod.name, mod.path))
     
+  setMetric('ck2launcher_scan_duration_seconds', time.time() - started, scan='mods')
+  setMetric('ck2launcher_mods', len(mods))
   return mods
 
 # END detectMods()
 
 
 
-def detectDlcs():
-  '''Detects all available DLC in the dlc directory
+def gameRoots():
+  '''Returns all configured game installs, the selected one included
   '''
   global config
   
-  # Go into dlc directory
-  try:
-    os.chdir(config.get('launcher', 'gamepath') + '/dlc')
-  except OSError:
-    # Unable to enter dlc directory
-    errorMsg('Could not find dlc directory "{0}". Please check configuration.'.format(config.get('launcher', 'gamepath') + '/dlc'), launcher)
-    return []
-  
-  # Search for DLC files
-  dlcfiles = glob.glob('*.dlc')
-  
-  # Create a dlc object for each found DLC
-  dlcs = []
-  for dlcfile in dlcfiles:
-    dlc = DLC(dlcfile)
-    dlcs.append(dlc)
-    infoMsg('Found DLC "{0}" in file "{1}".'.format(dlc.name, dlc.filename))
-    
-  return dlcs
+  roots = []
+  for root in splitPaths(config.get('launcher', 'gamepaths')) + [config.get('launcher', 'gamepath')]:
+    if os.path.abspath(root) not in [os.path.abspath(known) for known in roots]:
+      roots.append(root)
   
-# END detectDlcs()
+  return roots
 
+# END gameRoots()
 
 
-def loadConfiguration():
-  '''Opens the configuration file and uses the ConfigParser to read it
+
+def detectGameVersion(gamepath):
+  '''Detects the version of a game install from its launcher settings, returns 'unknown' if not available
+  
+  Arguments:
+  gamepath --- The game directory
+  
   '''
-  global config
+  settings = readFile(os.path.join(gamepath, 'launcher-settings.json'))
+  if settings is None:
+    return 'unknown'
   
-  # If the configuration does not exists, create it
-  if not os.path.exists(CONFIG_FILE):
-    open(CONFIG_FILE, 'w').close()
+  version = re.search('"rawVersion"[ \t]*:[ \t]*"([^"]*)"', settings)
+  if version is None:
+    version = re.search('"version"[ \t]*:[ \t]*"([^"]*)"', settings)
+  if version is None:
+    return 'unknown'
+  
+  return version.group(1)
+
+# END detectGameVersion()
+
+
+
+def scanGameRoot(gamepath):
+  '''Reads the version and all DLC files of a game install, using the cache partition of the install.
+  Runs in a scanner thread, so it must not show any dialogs.
+  
+  Returns a (version, dlcs) tuple where dlcs is a list of (filename, content) tuples, or None
+  if the install has no dlc directory.
+  
+  Arguments:
+  gamepath --- The game directory
+  
+  '''
+  dlcpath = os.path.join(gamepath, 'dlc')
+  if not os.path.isdir(dlcpath):
+    return None
+  
+  cache = getCache('dlcs', gamepath)
+  
+  # Search for DLC files
+  dlcfiles = sorted(glob.glob(os.path.join(dlcpath, '*.dlc')))
+  
+  # Only read DLC files that changed since the last scan
+  found = []
+  for path in dlcfiles:
+    dlcdata = cache.get(path)
+    if dlcdata is None:
+      dlcdata = readFile(path)
+      if dlcdata is not None:
+	cache.put(path, dlcdata)
+    
+    found.append((os.path.basename(path), dlcdata))
+  
+  cache.prune(dlcfiles)
+  return (detectGameVersion(gamepath), found)
+
+# END scanGameRoot()
+
+
+
+def detectGameInstalls():
+  '''Detects the version and all available DLC of each configured game install
+  '''
+  global launcher
+  
+  # Scan all game installs at the same time
+  started = time.time()
+  roots = gameRoots()
+  results = scanRoots(roots, scanGameRoot)
+  
+  # Create a game install with its dlc objects for each install
+  installs = []
+  for gamepath, result in zip(roots, results):
+    if result is None:
+      # Unable to enter dlc directory
+      errorMsg('Could not find dlc directory "{0}". Please check configuration.'.format(os.path.join(gamepath, 'dlc')), launcher)
+      installs.append(GameInstall(gamepath, 'unknown', []))
+      continue
+    
+    version, found = result
+    dlcs = []
+    for dlcfile, dlcdata in found:
+      dlc = DLC(dlcfile, dlcdata)
+      dlcs.append(dlc)
+      infoMsg('Found DLC "{0}" in file "{1}".'.format(dlc.name, dlc.filename))
+    
+    infoMsg('Found game version {0} in "{1}".'.format(version, gamepath))
+    installs.append(GameInstall(gamepath, version, dlcs))
+    setMetric('ck2launcher_dlcs', len(dlcs), install=gamepath)
+    
+  setMetric('ck2launcher_scan_duration_seconds', time.time() - started, scan='dlcs')
+  return installs
+  
+# END detectGameInstalls()
+
+
+
+def listModFiles(mod, subdirs=None):
+  '''Lists the files of a mod without reading them. Archives are listed from their central directory only.
+  
+  Returns a list of (name, location, key, size) tuples: name is the path inside the mod, location
+  is a (container, member) tuple for readModFile and key the stat key used for caching.
+  
+  Arguments:
+  mod --- The mod to list
+  subdirs --- Only list files in these top level directories of the mod (all files if None)
+  
+  '''
+  content = mod.contentPath()
+  if content is None:
+    return []
+  
+  files = []
+  if os.path.isdir(content):
+    # Mod content in a directory, only walk the wanted subdirectories
+    tops = [content]
+    if subdirs is not None:
+      tops = [os.path.join(content, subdir) for subdir in subdirs]
+    
+    for top in tops:
+      for dirpath, dirnames, filenames in os.walk(top):
+	for filename in filenames:
+	  path = os.path.join(dirpath, filename)
+	  try:
+	    st = os.stat(path)
+	  except OSError:
+	    continue
+	  
+	  files.append((os.path.relpath(path, content).replace(os.sep, '/'), (path, None), (st.st_mtime, st.st_size), st.st_size))
+    
+  elif zipfile.is_zipfile(content):
+    # Mod content in an archive, only read its central directory again when it changed
+    cache = getCache('archives', os.path.dirname(content))
+    members = cache.get(content)
+    if members is None:
+      archive = zipfile.ZipFile(content)
+      try:
+	members = [(info.filename, info.CRC, info.file_size) for info in archive.infolist() if not info.filename.endswith('/')]
+      finally:
+	archive.close()
+      cache.put(content, members)
+    
+    for member, crc, size in members:
+      if subdirs is None or member.split('/')[0] in subdirs:
+	files.append((member, (content, member), (crc, size), size))
+    
+  return files
+
+# END listModFiles()
+
+
+#: Archives opened by readModFile in this process
+openArchives = {}
+
+
+def readModFile(location, size=-1):
+  '''Reads a file listed by listModFiles, returns None if it can not be read
+  
+  Arguments:
+  location --- The (container, member) tuple of the file
+  size --- Number of bytes to read from the start of the file (everything if negative)
+  
+  '''
+  global openArchives
+  
+  container, member = location
+  try:
+    if member is None:
+      datafile = open(container, 'rb')
+    else:
+      # Keep archives open, the files of a mod are read one after another
+      if container not in openArchives:
+	openArchives[container] = zipfile.ZipFile(container)
+      datafile = openArchives[container].open(member)
+    
+    try:
+      return datafile.read(size)
+    finally:
+      datafile.close()
+  except (IOError, OSError, KeyError, zipfile.BadZipfile):
+    return None
+
+# END readModFile()
+
+
+def closeArchives():
+  '''Closes the archives opened by readModFile, so changed archives are opened again
+  '''
+  global openArchives
+  
+  for archive in openArchives.values():
+    archive.close()
+  openArchives.clear()
+
+# END closeArchives()
+
+
+def locationName(location):
+  '''Returns the path of a file listed by listModFiles as shown to the user
+  
+  Arguments:
+  location --- The (container, member) tuple of the file
+  
+  '''
+  container, member = location
+  if member is None:
+    return container
+  
+  return container + '/' + member
+
+# END locationName()
+
+
+
+def validateScript(data):
+  '''Tokenizes a Clausewitz script and returns its problems as a list of (line, problem) tuples
+  
+  Arguments:
+  data --- Content of the script file
+  
+  '''
+  problems = []
+  
+  # Encoding: the game reads scripts as Windows-1252
+  if data.startswith('\xef\xbb\xbf'):
+    problems.append((1, 'UTF-8 byte order mark, the game reads scripts as Windows-1252'))
+    data = data[3:]
+  else:
+    try:
+      data.decode('ascii')
+    except UnicodeDecodeError, error:
+      try:
+	data.decode('utf-8')
+	problems.append((data.count('\n', 0, error.start) + 1, 'UTF-8 encoded characters, the game reads scripts as Windows-1252'))
+      except UnicodeDecodeError:
+	# Not UTF-8, check for bytes Windows-1252 does not know
+	for match in UNDEFINED_BYTES.finditer(data):
+	  problems.append((data.count('\n', 0, match.start()) + 1, 'Byte 0x{0:02x} is not a Windows-1252 character'.format(ord(match.group()))))
+  
+  # Braces and quoting
+  line = 1
+  opened = []		# Lines of the braces that are still open
+  for match in SCRIPT_TOKENS.finditer(data):
+    token = match.group()
+    if token == '\n':
+      line += 1
+    elif token == '{':
+      opened.append(line)
+    elif token == '}':
+      if len(opened) > 0:
+	opened.pop()
+      else:
+	problems.append((line, 'Closing brace without matching opening brace'))
+    elif token == '\x00':
+      problems.append((line, 'NUL byte'))
+    elif token[0] == '"' and (len(token) == 1 or token[-1] != '"'):
+      problems.append((line, 'Unterminated string'))
+  
+  for openLine in opened:
+    problems.append((openLine, 'Opening brace is never closed'))
+  
+  problems.sort()
+  return problems
+
+# END validateScript()
+
+
+
+def validateFile(location):
+  '''Validates a single script file, runs in the validator processes
+  
+  Arguments:
+  location --- The (container, member) tuple of the file
+  
+  '''
+  data = readModFile(location)
+  if data is None:
+    return (location, [(0, 'Unable to read file')])
+  
+  return (location, validateScript(data))
+
+# END validateFile()
+
+
+
+def validateMods(mods):
+  '''Validates the scripts of the given mods. Only files changed since their last validation are read,
+  using a process pool when there are many of them.
+  
+  Returns a list of (mod, file, line, problem) tuples.
+  
+  Arguments:
+  mods --- The mods to validate
+  
+  '''
+  # Collect script files, take the results of unchanged files from the cache
+  results = {}
+  pending = []
+  owners = {}
+  ordered = []		# (mod, location) tuples in load order
+  for mod in mods:
+    content = mod.contentPath()
+    if content is None:
+      continue
+    
+    cache = getCache('validate', content)
+    names = []
+    for name, location, key, size in listModFiles(mod, SCRIPT_DIRS):
+      if not name.endswith('.txt'):
+	continue
+      
+      names.append(locationName(location))
+      owners[location] = (cache, key)
+      ordered.append((mod, location))
+      problems = cache.get(locationName(location), key)
+      if problems is None:
+	pending.append(location)
+      else:
+	results[location] = problems
+    
+    cache.prune(names)
+  
+  infoMsg('Validating {0} changed script files, {1} unchanged.'.format(len(pending), len(results)))
+  
+  # Validate changed files
+  if len(pending) >= VALIDATE_POOL_MINIMUM:
+    pool = multiprocessing.Pool()
+    try:
+      validated = list(pool.imap_unordered(validateFile, pending, VALIDATE_CHUNKSIZE))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    validated = [validateFile(location) for location in pending]
+    closeArchives()
+  
+  for location, problems in validated:
+    cache, key = owners[location]
+    cache.put(locationName(location), problems, key)
+    results[location] = problems
+  
+  # Report problems per mod in load order
+  report = []
+  for mod, location in ordered:
+    for line, problem in results[location]:
+      report.append((mod, locationName(location), line, problem))
+  
+  return report
+
+# END validateMods()
+
+
+
+class LoadCost:
+  '''Load cost of a mod or a set of mods
+  '''
+  
+  def __init__(self):
+    '''Creates an empty load cost
+    '''
+    self.files = 0		#: Number of files
+    self.bytes = 0		#: Total size of all files
+    self.textureBytes = 0	#: Size of all texture files
+    self.scriptBytes = 0	#: Size of all script files
+    self.overrides = 0		#: Number of files replacing a vanilla file
+    
+  
+  def add(self, other):
+    '''Adds another load cost to this one
+    
+    Arguments:
+    other --- The load cost to add
+    
+    '''
+    self.files += other.files
+    self.bytes += other.bytes
+    self.textureBytes += other.textureBytes
+    self.scriptBytes += other.scriptBytes
+    self.overrides += other.overrides
+    
+  
+  def columns(self):
+    '''Returns the load cost as the texts shown in the mod list and the report
+    '''
+    return [str(self.files), formatBytes(self.bytes), formatBytes(self.textureBytes), formatBytes(self.scriptBytes), str(self.overrides)]
+    
+  
+# END CLASS LoadCost
+
+
+#: Titles of the load cost columns, in the order of LoadCost.columns()
+LOADCOST_TITLES = ['Files', 'Size', 'Textures', 'Scripts', 'Overrides']
+
+
+def formatBytes(size):
+  '''Formats a size in bytes for humans
+  
+  Arguments:
+  size --- The size in bytes
+  
+  '''
+  for unit in ['B', 'KB', 'MB']:
+    if size < 1024:
+      return '{0:.0f} {1}'.format(size, unit) if unit == 'B' else '{0:.1f} {1}'.format(size, unit)
+    size /= 1024.0
+  
+  return '{0:.1f} GB'.format(size)
+
+# END formatBytes()
+
+
+
+def analyzeMod(mod, vanilla):
+  '''Computes the load cost of a single mod
+  
+  Arguments:
+  mod --- The mod to analyze
+  vanilla --- Set of the files of the game install
+  
+  '''
+  cost = LoadCost()
+  for name, location, key, size in listModFiles(mod):
+    cost.files += 1
+    cost.bytes += size
+    
+    extension = os.path.splitext(name)[1].lower()
+    if extension in TEXTURE_EXTENSIONS:
+      cost.textureBytes += size
+    elif extension in SCRIPT_EXTENSIONS:
+      cost.scriptBytes += size
+    
+    if name in vanilla:
+      cost.overrides += 1
+  
+  return cost
+
+# END analyzeMod()
+
+
+
+def analyzeMods(mods, install):
+  '''Computes the load cost of each mod, walking the mods concurrently.
+  Does not show any dialogs, so it can run outside the main thread.
+  
+  Returns a list with the load cost of each mod.
+  
+  Arguments:
+  mods --- The mods to analyze
+  install --- The game install whose files the mods override
+  
+  '''
+  vanilla = install.vanillaFiles()
+  return scanRoots(mods, lambda mod: analyzeMod(mod, vanilla), lambda mod: LoadCost())
+
+# END analyzeMods()
+
+
+
+def textureSize(header):
+  '''Estimates the video memory of a texture from its header
+  
+  Returns a (width, height, mip levels, bytes) tuple, all 0 if the header is not understood.
+  
+  Arguments:
+  header --- The first TEXTURE_HEADER_SIZE bytes of a DDS or TGA file
+  
+  '''
+  if header[:4] == 'DDS ' and len(header) >= 128:
+    flags, height, width, pitch, depth, mips = struct.unpack('<6I', header[8:32])
+    formatFlags, fourcc, bits = struct.unpack('<I4sI', header[80:92])
+    caps2 = struct.unpack('<I', header[112:116])[0]
+    
+    # Mip levels only count if the header says so
+    if not flags & 0x20000 or mips == 0:
+      mips = 1
+    
+    size = 0
+    for level in range(0, mips):
+      levelWidth = max(1, width >> level)
+      levelHeight = max(1, height >> level)
+      if formatFlags & 0x4:
+	# Compressed, stored in 4x4 blocks
+	size += ((levelWidth + 3) // 4) * ((levelHeight + 3) // 4) * DDS_BLOCK_BYTES.get(fourcc, 16)
+      else:
+	size += levelWidth * levelHeight * max(bits, 8) // 8
+    
+    # Cube maps hold six faces, volume textures several slices
+    if caps2 & 0x200:
+      size *= 6
+    elif caps2 & 0x200000 and flags & 0x800000 and depth > 1:
+      size *= depth
+    
+    return (width, height, mips, size)
+  
+  if len(header) >= 18 and ord(header[2]) in (1, 2, 3, 9, 10, 11):
+    # TGA, uploaded uncompressed with four bytes per pixel and without mip levels
+    width, height = struct.unpack('<2H', header[12:16])
+    return (width, height, 1, width * height * 4)
+  
+  return (0, 0, 0, 0)
+
+# END textureSize()
+
+
+
+def estimateModVram(mod):
+  '''Estimates the video memory of the textures in the gfx directory of a mod, only reading their headers
+  
+  Returns a (textures, bytes) tuple.
+  
+  Arguments:
+  mod --- The mod to estimate
+  
+  '''
+  content = mod.contentPath()
+  if content is None:
+    return (0, 0)
+  
+  cache = getCache('textures', content)
+  textures = 0
+  total = 0
+  names = []
+  for name, location, key, size in listModFiles(mod, ['gfx']):
+    if os.path.splitext(name)[1].lower() not in TEXTURE_EXTENSIONS:
+      continue
+    
+    names.append(locationName(location))
+    estimate = cache.get(locationName(location), key)
+    if estimate is None:
+      estimate = textureSize(readModFile(location, TEXTURE_HEADER_SIZE) or '')
+      cache.put(locationName(location), estimate, key)
+    
+    textures += 1
+    total += estimate[3]
+  
+  cache.prune(names)
+  return (textures, total)
+
+# END estimateModVram()
+
+
+
+def estimateVram(mods):
+  '''Estimates the video memory of the textures of each mod, reading the mods concurrently.
+  Does not show any dialogs, so it can run outside the main thread.
+  
+  Returns a list with a (textures, bytes) tuple for each mod.
+  
+  Arguments:
+  mods --- The mods to estimate
+  
+  '''
+  try:
+    return scanRoots(mods, estimateModVram, lambda mod: (0, 0))
+  finally:
+    closeArchives()
+
+# END estimateVram()
+
+
+def modSetChecksum(mods):
+  '''Returns the checksum identifying a resolved mod set, it does not change when the mods are updated
+  
+  Arguments:
+  mods --- The mods in load order
+  
+  '''
+  return hashlib.md5('\n'.join(repr(mod.identity()) for mod in mods)).hexdigest()
+
+# END modSetChecksum()
+
+
+
+def modSetFingerprint(mods):
+  '''Returns a checksum of the modfiles and content of a mod set, it changes when one of the mods is updated
+  
+  Arguments:
+  mods --- The mods in load order
+  
+  '''
+  stats = []
+  for mod in mods:
+    # Every file, the directory of an unpacked mod does not change when files in it are edited
+    try:
+      files = sorted((name, key) for name, location, key, size in listModFiles(mod))
+    except (IOError, zipfile.BadZipfile):
+      # Damaged archive, its stat still tells whether it changed
+      files = statKey(mod.contentPath())
+    stats.append(repr((mod.identity(), statKey(mod.path), files)))
+  
+  return hashlib.md5('\n'.join(stats)).hexdigest()
+
+# END modSetFingerprint()
+
+
+
+def dlcSetChecksum(dlcs):
+  '''Returns the checksum identifying a set of enabled DLC's
+  
+  Arguments:
+  dlcs --- The enabled DLC's
+  
+  '''
+  return hashlib.md5('\n'.join(sorted(dlc.filename for dlc in dlcs))).hexdigest()
+
+# END dlcSetChecksum()
+
+
+
+def processTree(pid):
+  '''Returns the process ids of a process and all its descendants (PREPEND commands start the game as a child)
+  
+  Arguments:
+  pid --- Process id of the root process
+  
+  '''
+  children = {}
+  for entry in os.listdir('/proc'):
+    if not entry.isdigit():
+      continue
+    
+    stat = readFile('/proc/{0}/stat'.format(entry))
+    if stat is None:
+      continue
+    
+    # Fields after the command name, which may contain spaces
+    parent = int(stat[stat.rfind(')') + 2:].split()[1])
+    children.setdefault(parent, []).append(int(entry))
+  
+  tree = [pid]
+  for process in tree:
+    tree.extend(children.get(process, []))
+  
+  return tree
+
+# END processTree()
+
+
+
+def processCpuTime(pids, seen=None):
+  '''Returns the CPU time in seconds used by the processes so far
+  
+  Arguments:
+  pids --- Process ids
+  seen --- Dict of the CPU ticks seen so far per process id, updated so processes that exited keep counting
+  
+  '''
+  if seen is None:
+    seen = {}
+  
+  for pid in pids:
+    stat = readFile('/proc/{0}/stat'.format(pid))
+    if stat is None:
+      continue
+    
+    # utime and stime, plus cutime and cstime of the children that exited and were waited for
+    fields = stat[stat.rfind(')') + 2:].split()
+    seen[pid] = max(seen.get(pid, 0), sum(int(field) for field in fields[11:15]))
+  
+  return sum(seen.values()) / float(os.sysconf('SC_CLK_TCK'))
+
+# END processCpuTime()
+
+
+
+def processRss(pids):
+  '''Returns the resident memory in bytes used by the processes
+  
+  Arguments:
+  pids --- Process ids
+  
+  '''
+  rss = 0
+  for pid in pids:
+    status = readFile('/proc/{0}/status'.format(pid))
+    if status is None:
+      continue
+    
+    match = re.search('^VmRSS:[ \t]*([0-9]+) kB', status, re.MULTILINE)
+    if match is not None:
+      rss += int(match.group(1)) * 1024
+  
+  return rss
+
+# END processRss()
+
+
+
+class GameSession:
+  '''A running game, detects when it finished loading
+  '''
+  
+  def __init__(self, process, mods, dlcs, version):
+    '''Creates a new game session, right after the game was started
+    
+    Arguments:
+    process --- The Popen object of the game
+    mods --- The mods loaded, in load order
+    dlcs --- The enabled DLC's
+    version --- Version of the game install
+    
+    '''
+    global config
+    
+    self.process = process			#: The Popen object of the game
+    self.started = time.time()			#: Time the game was started
+    self.readyAfter = None			#: Seconds it took the game to finish loading, None until then
+    self.exitCode = None			#: Exit code of the game, None while running
+    self.mods = [mod.name for mod in mods]	#: Names of the mods loaded, in load order
+    self.modSet = modSetChecksum(mods)		#: Checksum of the mod set
+    self.fingerprint = modSetFingerprint(mods)	#: Checksum of the content of the mod set
+    self.dlcSet = dlcSetChecksum(dlcs)		#: Checksum of the enabled DLC's
+    self.version = version			#: Version of the game install
+    self.ended = None				#: Time the game exited, None while running
+    self.peakRss = 0				#: Peak resident memory of the game and its PREPEND commands
+    
+    # Readiness is detected from a marker line in the game log if one is configured, else from the game becoming idle
+    self.marker = None
+    if len(config.get('launcher', 'readymarker').strip()) > 0:
+      self.marker = re.compile(config.get('launcher', 'readymarker'))
+    self.logfile = os.path.expanduser(config.get('launcher', 'readylog'))
+    try:
+      self.logOffset = os.path.getsize(self.logfile)
+    except OSError:
+      # Log not written yet, the game will create it
+      self.logOffset = 0
+    
+    self.lastPoll = self.started
+    self.lastCpu = 0.0
+    self.cpuTicks = {}
+    self.idleSince = None
+    self.idleTicks = 0
+    
+  
+  def poll(self):
+    '''Checks whether the game has exited or finished loading, returns the exit code (None while running)
+    '''
+    self.exitCode = self.process.poll()
+    if self.exitCode is not None:
+      if self.ended is None:
+	self.ended = time.time()
+      return self.exitCode
+    
+    pids = processTree(self.process.pid)
+    self.peakRss = max(self.peakRss, processRss(pids))
+    
+    if self.readyAfter is None:
+      if self.marker is not None:
+	self.checkLog()
+      else:
+	self.checkIdle(pids)
+      
+      if self.readyAfter is not None:
+	okMsg('Game finished loading after {0:.1f} seconds.'.format(self.readyAfter))
+    
+    return self.exitCode
+    
+  
+  def setMetrics(self):
+    '''Sets the game metrics from this finished session
+    '''
+    if self.readyAfter is not None:
+      setMetric('ck2launcher_game_load_seconds', self.readyAfter)
+    setMetric('ck2launcher_game_exit_code', self.exitCode)
+    setMetric('ck2launcher_game_session_seconds', (self.ended or time.time()) - self.started)
+    setMetric('ck2launcher_game_peak_rss_bytes', self.peakRss)
+    
+  
+  def checkLog(self):
+    '''Looks for the ready marker in the lines the game logged since it was started
+    '''
+    try:
+      gamelog = open(self.logfile)
+    except IOError:
+      return
+    
+    try:
+      # The game truncates its log on start
+      if os.path.getsize(self.logfile) < self.logOffset:
+	self.logOffset = 0
+      gamelog.seek(self.logOffset)
+      lines = gamelog.read()
+    finally:
+      gamelog.close()
+    
+    # Only look at complete lines, the rest is read again on the next poll
+    complete = lines.rfind('\n') + 1
+    self.logOffset += complete
+    if self.marker.search(lines[:complete]):
+      self.readyAfter = time.time() - self.started
+    
+  
+  def checkIdle(self, pids):
+    '''Checks whether the CPU usage of the game dropped, which means it finished loading
+    
+    Arguments:
+    pids --- Process ids of the game and its PREPEND commands
+    
+    '''
+    now = time.time()
+    cpu = processCpuTime(pids, self.cpuTicks)
+    usage = (cpu - self.lastCpu) / max(now - self.lastPoll, 0.001)
+    
+    if usage < READY_IDLE_CPU and cpu > 0:
+      if self.idleTicks == 0:
+	self.idleSince = self.lastPoll
+      self.idleTicks += 1
+      if self.idleTicks >= READY_IDLE_TICKS:
+	self.readyAfter = self.idleSince - self.started
+    else:
+      self.idleTicks = 0
+    
+    self.lastPoll = now
+    self.lastCpu = cpu
+    
+  
+# END CLASS GameSession
+
+
+
+def openHistory():
+  '''Opens the load time history database, creating it if needed
+  '''
+  history = sqlite3.connect(HISTORY_FILE)
+  history.execute('''CREATE TABLE IF NOT EXISTS sessions (
+		       started REAL, modset TEXT, dlcset TEXT, fingerprint TEXT, version TEXT,
+		       mods TEXT, loadtime REAL, exitcode INTEGER)''')
+  history.execute('CREATE INDEX IF NOT EXISTS sessions_sets ON sessions (modset, dlcset, started)')
+  return history
+
+# END openHistory()
+
+
+
+def recordSession(session):
+  '''Adds a finished game session to the load time history
+  
+  Arguments:
+  session --- The finished game session
+  
+  '''
+  try:
+    history = openHistory()
+    try:
+      with history:
+	history.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+			(session.started, session.modSet, session.dlcSet, session.fingerprint, session.version,
+			 ','.join(session.mods), session.readyAfter, session.exitCode))
+    finally:
+      history.close()
+  except sqlite3.Error, error:
+    infoMsg('Unable to record load time: {0}'.format(error))
+
+# END recordSession()
+
+
+
+def loadHistory(modSet, dlcSet):
+  '''Returns the history of a mod and DLC set, oldest session first, annotated with trends.
+  
+  Returns a list of (started, version, loadtime, change, exitcode, note) tuples, change is
+  the difference to the median of the earlier load times.
+  
+  Arguments:
+  modSet --- Checksum of the mod set
+  dlcSet --- Checksum of the DLC set
+  
+  '''
+  history = openHistory()
+  try:
+    rows = history.execute('SELECT started, version, fingerprint, loadtime, exitcode FROM sessions WHERE modset = ? AND dlcset = ? ORDER BY started',
+			   (modSet, dlcSet)).fetchall()
+  finally:
+    history.close()
+  
+  sessions = []
+  loadtimes = []
+  lastFingerprint = None
+  lastVersion = None
+  for started, version, fingerprint, loadtime, exitcode in rows:
+    notes = []
+    if lastFingerprint is not None and fingerprint != lastFingerprint:
+      notes.append('mods updated')
+    if lastVersion is not None and version != lastVersion:
+      notes.append('game updated')
+    
+    change = None
+    if loadtime is not None and len(loadtimes) > 0:
+      median = sorted(loadtimes)[len(loadtimes) // 2]
+      change = loadtime - median
+      if loadtime > median * REGRESSION_FACTOR:
+	notes.append('regression')
+    
+    if loadtime is not None:
+      loadtimes.append(loadtime)
+    lastFingerprint = fingerprint
+    lastVersion = version
+    sessions.append((started, version, loadtime, change, exitcode, ', '.join(notes)))
+  
+  return sessions
+
+# END loadHistory()
+
+
+
+def historyColumns(session):
+  '''Returns a session of loadHistory as the texts shown in the history window and command
+  
+  Arguments:
+  session --- The session
+  
+  '''
+  started, version, loadtime, change, exitcode, note = session
+  return [datetime.datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M'), version,
+	  '-' if loadtime is None else '{0:.1f} s'.format(loadtime),
+	  '' if change is None else '{0:+.1f} s'.format(change),
+	  '' if exitcode is None else str(exitcode), note]
+
+# END historyColumns()
+
+
+#: Titles of the history columns, in the order of historyColumns()
+HISTORY_TITLES = ['Started', 'Version', 'Load time', 'Change', 'Exit code', 'Note']
+
+
+
+def stopGame(process):
+  '''Stops a running game and everything started by its PREPEND commands
+  
+  Arguments:
+  process --- The Popen object of the game
+  
+  '''
+  pids = processTree(process.pid)
+  for sig in [signal.SIGTERM, signal.SIGKILL]:
+    for pid in reversed(pids):
+      try:
+	os.kill(pid, sig)
+      except OSError:
+	# Already gone
+	pass
+    
+    # Give the game some time to exit on its own
+    deadline = time.time() + STOP_TIMEOUT
+    while process.poll() is None and time.time() < deadline:
+      time.sleep(0.1)
+    if process.poll() is not None:
+      return
+
+# END stopGame()
+
+
+
+def runTrial(mods, install, enabledDlcs, timeout, slow):
+  '''Runs the game with a set of mods until it finished loading, exited or timed out and stops it again.
+  
+  Returns whether the mod set is bad: the game exited with an error, did not finish loading in time
+  or, if slow is given, took longer than slow seconds to load.
+  
+  Arguments:
+  mods --- The mods to load, in load order
+  install --- The game install to run
+  enabledDlcs --- The DLC's to enable
+  timeout --- Seconds after which the game is stopped
+  slow --- Seconds of load time from which on the mod set counts as bad, None to only look for crashes
+  
+  '''
+  command = buildCommand(mods, [dlc for dlc in install.dlcs if dlc not in enabledDlcs])
+  infoMsg('Trying {0} mods: {1}'.format(len(mods), ', '.join(mod.name for mod in mods)))
+  process = Popen(command, cwd=install.path)
+  session = GameSession(process, mods, enabledDlcs, install.version)
+  
+  while session.poll() is None and session.readyAfter is None and time.time() - session.started < timeout:
+    time.sleep(GAME_POLL_INTERVAL / 1000.0)
+  
+  if session.readyAfter is not None:
+    bad = slow is not None and session.readyAfter > slow
+    result = 'loaded after {0:.1f} seconds'.format(session.readyAfter)
+  elif session.exitCode is not None:
+    bad = session.exitCode != 0
+    result = 'exited with code {0}'.format(session.exitCode)
+  else:
+    bad = True
+    result = 'timed out after {0} seconds'.format(timeout)
+  
+  # Bisect trials are game sessions too
+  if session.exitCode is None:
+    stopGame(process)
+    session.poll()
+  recordSession(session)
+  session.setMetrics()
+  writeMetrics('trial')
+  
+  infoMsg('Game {0}: {1}.'.format(result, 'bad' if bad else 'good'))
+  return bad
+
+# END runTrial()
+
+
+
+def dependencyClosure(mods, allMods):
+  '''Returns the mods together with all mods they depend on, in the order of allMods
+  
+  Arguments:
+  mods --- The mods whose dependencies are added
+  allMods --- All mods that may be added, in load order
+  
+  '''
+  byName = dict((mod.name, mod) for mod in allMods)
+  closure = set(mods)
+  pending = list(mods)
+  while len(pending) > 0:
+    mod = pending.pop()
+    for dependency in mod.dependencies or []:
+      if dependency in byName and byName[dependency] not in closure:
+	closure.add(byName[dependency])
+	pending.append(byName[dependency])
+  
+  return [mod for mod in allMods if mod in closure]
+
+# END dependencyClosure()
+
+
+
+def bisectMods(mods, trial):
+  '''Finds the mods that make a mod set bad by halving the suspects, in O(log n) trials.
+  Each tried subset contains all dependencies of its mods, so it is a valid mod set. Mods
+  cleared by a trial stay in the later ones, so mods that are only bad together are found
+  as well: first the last mod needed, then the mods it needs to be bad with.
+  
+  Returns (suspects, partners, confirmed): the remaining suspects (more than one if they can
+  not be loaded apart), the mods they are only bad together with (empty if they are bad on
+  their own) and whether the suspects and partners were confirmed to be bad together. Returns
+  (None, None, False) if the whole set is not bad and ([], [], True) if the game is bad without
+  any mods as well, so no mod can be blamed.
+  
+  Arguments:
+  mods --- The mods in load order
+  trial --- Function taking a list of mods in load order, returns whether that mod set is bad
+  
+  '''
+  # Do not run the same mod set twice
+  results = {}
+  def tryMods(subset):
+    key = tuple(mod.path for mod in subset)
+    if key not in results:
+      results[key] = trial(subset)
+    return results[key]
+  
+  def narrow(suspects, background):
+    # The background together with the suspects is bad, halve the suspects keeping that true
+    while len(suspects) > 1:
+      middle = len(suspects) // 2
+      progress = False
+      
+      # Try the first half, or the second half if dependencies make the first one include all suspects
+      for half in [suspects[:middle], suspects[middle:]]:
+	subset = dependencyClosure(background + half, mods)
+	inSubset = [mod for mod in suspects if mod in subset]
+	if len(inSubset) == len(suspects):
+	  continue
+	
+	if tryMods(subset):
+	  suspects = inSubset
+	else:
+	  # Cleared mods stay loaded, the rest may only be bad together with them
+	  background = background + inSubset
+	  suspects = [mod for mod in suspects if mod not in inSubset]
+	progress = True
+	break
+      
+      if not progress:
+	# The remaining suspects depend on each other and can not be split
+	break
+    
+    return (suspects, background)
+  
+  if not tryMods(mods):
+    return (None, None, False)
+  
+  # A broken game or readiness setting makes every run bad, do not blame a mod for it
+  if tryMods([]):
+    return ([], [], True)
+  
+  suspects, background = narrow(list(mods), [])
+  if tryMods(dependencyClosure(suspects, mods)):
+    return (suspects, [], True)
+  
+  # Only bad together with cleared mods, find the ones needed among them
+  partners, background = narrow([mod for mod in mods if mod in background], suspects)
+  return (suspects, partners, tryMods(dependencyClosure(suspects + partners, mods)))
+
+# END bisectMods()
+
+
+
+def loadConfiguration():
+  '''Opens the configuration file and uses the ConfigParser to read it
+  '''
+  global config
+  
+  # If the configuration does not exists, create it
+  if not os.path.exists(CONFIG_FILE):
+    open(CONFIG_FILE, 'w').close()
   
   # Load configuration from file
   config = ConfigParser.SafeConfigParser()
@@ -836,24 +3575,345 @@ def loadConfiguration():
   if not config.has_option('launcher', 'gamepath'):
     config.set('launcher', 'gamepath', '~/.local/share/Steam/SteamApps/common/Crusader Kings II'.replace('~', os.path.expanduser('~')))
   
+  if not config.has_option('launcher', 'gamepaths'):
+    config.set('launcher', 'gamepaths', config.get('launcher', 'gamepath'))
+  
   if not config.has_option('launcher', 'modpath'):
     config.set('launcher', 'modpath', '~/Documents/Paradox Interactive/Crusader Kings II/mod'.replace('~', os.path.expanduser('~')))
     
+  if not config.has_option('launcher', 'extramodpaths'):
+    config.set('launcher', 'extramodpaths', '')
+    
   if not config.has_option('launcher', 'prepend'):
     config.set('launcher', 'prepend', '')
     
   if not config.has_option('launcher', 'gamebinary'):
     config.set('launcher', 'gamebinary', 'ck2')
     
+  if not config.has_option('launcher', 'validatescripts'):
+    config.set('launcher', 'validatescripts', 'false')
+    
+  if not config.has_option('launcher', 'readylog'):
+    config.set('launcher', 'readylog', os.path.dirname(config.get('launcher', 'modpath')) + '/logs/system.log')
+    
+  if not config.has_option('launcher', 'readymarker'):
+    config.set('launcher', 'readymarker', '')
+    
+  if not config.has_option('launcher', 'vrambudget'):
+    config.set('launcher', 'vrambudget', '0')
+    
+  if not config.has_option('launcher', 'metricsfile'):
+    config.set('launcher', 'metricsfile', '')
+    
+  if not config.has_option('launcher', 'metricsjson'):
+    config.set('launcher', 'metricsjson', '')
+    
   # Save configuration to file
   config.write(open(CONFIG_FILE, 'w'))
     
 # END loadConfiguration()
 
 
+def commandMods(names):
+  '''Returns the mods named on the command line in load order, or the mods selected in the launcher if none are named.
+  Returns None if a named mod is not found.
+  
+  Arguments:
+  names --- Names or modfiles of the mods
+  
+  '''
+  global config
+  
+  if len(names) == 0:
+    selected = []
+    if config.has_option('launcher', 'selectedmods'):
+      selected = config.get('launcher', 'selectedmods').split(',')
+    return sortMods([mod for mod in detectMods() if mod.isSelectedIn(selected)])
+  
+  mods = [mod for mod in detectMods() if mod.name in names or mod.filename in names]
+  missing = [name for name in names if not any(name in (mod.name, mod.filename) for mod in mods)]
+  for name in missing:
+    errorMsg('Mod "{0}" not found.'.format(name))
+  
+  if len(missing) > 0:
+    return None
+  
+  return sortMods(mods)
+
+# END commandMods()
+
+
+
+def commandInstall():
+  '''Returns the selected game install with its DLC's
+  '''
+  global config
+  
+  for install in detectGameInstalls():
+    if os.path.abspath(install.path) == os.path.abspath(config.get('launcher', 'gamepath')):
+      return install
+
+# END commandInstall()
+
+
+
+def commandDlcs(install):
+  '''Returns the DLC's of a game install that were selected in the launcher
+  
+  Arguments:
+  install --- The game install
+  
+  '''
+  global config
+  
+  if not config.has_option('launcher', 'selecteddlcs'):
+    return install.dlcs
+  
+  return [dlc for dlc in install.dlcs if dlc.filename in config.get('launcher', 'selecteddlcs').split(',')]
+
+# END commandDlcs()
+
+
+
+def validateCommand(args):
+  '''Command line: validates the scripts of the given mods
+  
+  Arguments:
+  args --- Parsed command line arguments
+  
+  '''
+  mods = commandMods(args.mods)
+  if mods is None:
+    return 2
+  if len(mods) == 0:
+    okMsg('No mods selected, nothing to do.')
+    return 0
+  
+  okMsg('Validating scripts of {0} mods...'.format(len(mods)))
+  report = validateMods(mods)
+  saveCaches()
+  
+  for mod, filename, line, problem in report:
+    print('{0}:{1}: {2}'.format(filename, line, problem))
+  
+  okMsg('Done. Found {0} script problems.'.format(len(report)))
+  return 1 if len(report) > 0 else 0
+
+# END validateCommand()
+
+
+
+def reportCommand(args):
+  '''Command line: shows the load cost of the given mods
+  
+  Arguments:
+  args --- Parsed command line arguments
+  
+  '''
+  mods = commandMods(args.mods)
+  if mods is None:
+    return 2
+  if len(mods) == 0:
+    okMsg('No mods selected, nothing to do.')
+    return 0
+  
+  install = commandInstall()
+  okMsg('Analyzing load cost of {0} mods...'.format(len(mods)))
+  costs = analyzeMods(mods, install)
+  saveCaches()
+  
+  # One line for each mod in load order and one for the whole set
+  total = LoadCost()
+  rows = []
+  for mod, cost in zip(mods, costs):
+    total.add(cost)
+    rows.append([mod.name] + cost.columns())
+  rows.append(['Total'] + total.columns())
+  
+  width = max([len('Mod')] + [len(row[0]) for row in rows])
+  print('{0:<{1}}'.format('Mod', width) + ''.join('{0:>12}'.format(title) for title in LOADCOST_TITLES))
+  for row in rows:
+    print('{0:<{1}}'.format(row[0], width) + ''.join('{0:>12}'.format(column) for column in row[1:]))
+  
+  return 0
+
+# END reportCommand()
+
+
+
+def historyCommand(args):
+  '''Command line: shows the load time history of the given mods with the selected DLC's
+  
+  Arguments:
+  args --- Parsed command line arguments
+  
+  '''
+  global config
+  
+  mods = commandMods(args.mods)
+  if mods is None:
+    return 2
+  install = commandInstall()
+  dlcs = commandDlcs(install)
+  
+  print(' '.join('{0:<16}'.format(title) for title in HISTORY_TITLES))
+  for session in loadHistory(modSetChecksum(mods), dlcSetChecksum(dlcs)):
+    print(' '.join('{0:<16}'.format(column) for column in historyColumns(session)))
+  
+  return 0
+
+# END historyCommand()
+
+
+
+def vramCommand(args):
+  '''Command line: estimates the video memory needed by the textures of the given mods
+  
+  Arguments:
+  args --- Parsed command line arguments
+  
+  '''
+  global config
+  
+  mods = commandMods(args.mods)
+  if mods is None:
+    return 2
+  if len(mods) == 0:
+    okMsg('No mods selected, nothing to do.')
+    return 0
+  
+  okMsg('Estimating texture memory of {0} mods...'.format(len(mods)))
+  estimates = estimateVram(mods)
+  saveCaches()
+  
+  rows = [[mod.name, str(textures), formatBytes(size)] for mod, (textures, size) in zip(mods, estimates)]
+  rows.append(['Total', str(sum(textures for textures, size in estimates)), formatBytes(sum(size for textures, size in estimates))])
+  
+  width = max([len('Mod')] + [len(row[0]) for row in rows])
+  print('{0:<{1}}{2:>12}{3:>12}'.format('Mod', width, 'Textures', 'VRAM'))
+  for row in rows:
+    print('{0:<{1}}{2:>12}{3:>12}'.format(row[0], width, row[1], row[2]))
+  
+  # Over budget is an error, so scripts can check before launching
+  budget = config.getint('launcher', 'vrambudget') * 1024 * 1024
+  if budget > 0 and sum(size for textures, size in estimates) > budget:
+    warningMsg('The estimated texture memory exceeds the budget of {0}.'.format(formatBytes(budget)))
+    return 1
+  
+  return 0
+
+# END vramCommand()
+
+
+
+def bisectCommand(args):
+  '''Command line: finds the mod that makes the game crash or load slowly
+  
+  Arguments:
+  args --- Parsed command line arguments
+  
+  '''
+  global config
+  
+  mods = commandMods(args.mods)
+  if mods is None:
+    return 2
+  if len(mods) == 0:
+    okMsg('No mods selected, nothing to do.')
+    return 0
+  
+  install = commandInstall()
+  dlcs = commandDlcs(install)
+  
+  okMsg('Bisecting {0} mods...'.format(len(mods)))
+  trials = [0]
+  def trial(subset):
+    trials[0] += 1
+    return runTrial(subset, install, dlcs, args.timeout, args.slow)
+  
+  try:
+    suspects, partners, confirmed = bisectMods(mods, trial)
+  except OSError:
+    errorMsg('Unable to run the game. Please check that the GAMEPATH is set correctly and that the commands in PREPEND are correct.')
+    return 2
+  
+  if suspects is None:
+    okMsg('Done after {0} runs. The game works with all {1} mods.'.format(trials[0], len(mods)))
+    return 0
+  
+  if len(suspects) == 0:
+    errorMsg('The game is bad without any mods as well. Please check GAMEPATH, READYLOG / READYMARKER and --timeout.')
+    return 2
+  
+  names = ', '.join('"{0}"'.format(mod.name) for mod in suspects)
+  if not confirmed:
+    okMsg('Done after {0} runs. Could not isolate a single culprit, the game is only bad with more of the mods together (last suspects: {1}).'.format(trials[0], names))
+  elif len(partners) > 0:
+    okMsg('Done after {0} runs. {1} is only bad together with: {2}'.format(trials[0], names, ', '.join('"{0}" ({1})'.format(mod.name, mod.path) for mod in partners)))
+  elif len(suspects) == 1:
+    okMsg('Done after {0} runs. Culprit: "{1}" ({2}).'.format(trials[0], suspects[0].name, suspects[0].path))
+  else:
+    okMsg('Done after {0} runs. The culprit is one of these mods, they can not be loaded apart: {1}'.format(trials[0], names))
+  
+  return 1
+
+# END bisectCommand()
+
+
+
+def runCommand(argv):
+  '''Runs a command line command instead of the launcher window, returns its exit code
+  
+  Arguments:
+  argv --- The command line arguments
+  
+  '''
+  global showDialogs
+  
+  parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), description=APPNAME)
+  commands = parser.add_subparsers(title='commands')
+  
+  validateParser = commands.add_parser('validate', help='check the scripts of mods for syntax and encoding problems')
+  validateParser.add_argument('mods', nargs='*', metavar='MOD', help='name or modfile of a mod (default: the mods selected in the launcher)')
+  validateParser.set_defaults(func=validateCommand)
+  
+  reportParser = commands.add_parser('report', help='show files, sizes and vanilla overrides of mods')
+  reportParser.add_argument('mods', nargs='*', metavar='MOD', help='name or modfile of a mod (default: the mods selected in the launcher)')
+  reportParser.set_defaults(func=reportCommand)
+  
+  historyParser = commands.add_parser('history', help='show the load times of mods with the selected DLC\'s')
+  historyParser.add_argument('mods', nargs='*', metavar='MOD', help='name or modfile of a mod (default: the mods selected in the launcher)')
+  historyParser.set_defaults(func=historyCommand)
+  
+  vramParser = commands.add_parser('vram', help='estimate the video memory needed by the textures of mods')
+  vramParser.add_argument('mods', nargs='*', metavar='MOD', help='name or modfile of a mod (default: the mods selected in the launcher)')
+  vramParser.set_defaults(func=vramCommand)
+  
+  bisectParser = commands.add_parser('bisect', help='find the mod that makes the game crash or load slowly by running it with halves of the mods')
+  bisectParser.add_argument('--timeout', type=int, default=BISECT_TIMEOUT, metavar='SECONDS', help='stop a run that did not finish loading after SECONDS (default: %(default)s)')
+  bisectParser.add_argument('--slow', type=float, metavar='SECONDS', help='count runs that take longer than SECONDS to load as bad (default: only crashes and timeouts)')
+  bisectParser.add_argument('mods', nargs='*', metavar='MOD', help='name or modfile of a mod (default: the mods selected in the launcher)')
+  bisectParser.set_defaults(func=bisectCommand)
+  
+  args = parser.parse_args(argv)
+  
+  # No window to show dialogs in
+  showDialogs = False
+  loadConfiguration()
+  
+  return args.func(args)
+
+# END runCommand()
+
+
 def main():
   global ck2Process, launcher
   
+  # Command line commands do not need the launcher window
+  if len(sys.argv) > 1:
+    exit(runCommand(sys.argv[1:]))
+  
+  started = time.time()
   app = wx.App(False)
   
   # Greet user
@@ -866,23 +3926,14 @@ def main():
   # Create user interface
   launcher = Launcher(None, APPNAME)
   launcher.Show()
+  setMetric('ck2launcher_startup_seconds', time.time() - started)
+  writeMetrics('start')
+  okMsg('Launcher ready after {0:.2f} seconds'.format(time.time() - started))
   app.MainLoop()
   
-  # If game started wait for process to end
+  # The launcher returns to its window after each game session, so it is
+  # only closed when no game is running
   launcher = None
-  if ck2Process != None:
-    exitCode = ck2Process.wait()
-    if exitCode == 0:
-      # Game closed correctly
-      okMsg('Game closed without error.')
-    else:
-      # Something went wrong
-      errorMsg('Process closed with error code {0}. Please check configuration.'.format(str(exitCode)))
-      
-      # At this point it is too late to reuse the current launcher
-      # Launch another instance
-      os.chdir(sys.path[0])
-      Popen(sys.argv[0])
   
   exit(0)
   
@@ -0,0 +1,47 @@
+#!/bin/sh
+# Stub game binary for trying out 'ck2launcher.py bisect' without the real game.
+# Set GAMEBINARY to this script, READYLOG to $STUB_LOG and READYMARKER to $STUB_MARKER.
+#
+#  STUB_CRASH   Mods (as passed to -mod=, e.g. mod/a.mod) that make the game exit with an
+#               error. Join mods with '+' to crash only when all of them are loaded.
+#  STUB_SLOW    Mods that make the game take STUB_DELAY (default 5) seconds to load.
+#  STUB_LOG     File the ready marker is appended to once loaded (default: none, so the
+#               launcher never sees the game finish loading).
+#  STUB_MARKER  The ready marker (default: 'Main menu').
+
+mods=' '
+delay=0
+for arg in "$@"; do
+  case "$arg" in
+    -mod=*)
+      mod="${arg#-mod=}"
+      mods="$mods$mod "
+      for slow in $STUB_SLOW; do
+        if [ "$mod" = "$slow" ]; then
+          delay=${STUB_DELAY:-5}
+        fi
+      done
+      ;;
+  esac
+done
+
+for group in $STUB_CRASH; do
+  all=1
+  for part in $(echo "$group" | tr '+' ' '); do
+    case "$mods" in
+      *" $part "*) ;;
+      *) all=0 ;;
+    esac
+  done
+  if [ $all -eq 1 ]; then
+    exit 1
+  fi
+done
+
+sleep $delay
+if [ -n "$STUB_LOG" ]; then
+  echo "${STUB_MARKER:-Main menu}" >> "$STUB_LOG"
+fi
+
+# Keep running like the game until the launcher stops it
+exec sleep 600
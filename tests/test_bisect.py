@@ -0,0 +1,163 @@
+"""Tests for bisecting mods, against fake trials and against the stub game binary.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ck2launcher
+
+STUBGAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubgame.sh')
+
+
+class FakeMod:
+  '''Just enough of a mod for bisectMods
+  '''
+
+  def __init__(self, name, dependencies=None):
+    self.name = name
+    self.path = name + '.mod'
+    self.dependencies = dependencies
+
+# END CLASS FakeMod
+
+
+
+class BisectModsTest(unittest.TestCase):
+  '''bisectMods with trials that decide from the mod names
+  '''
+
+  def bisect(self, count, bad, dependencies={}):
+    '''Bisects count mods named m0, m1, ..., returns the names of the suspects and partners,
+    whether they were confirmed and all tried mod sets
+    '''
+    mods = [FakeMod('m{0}'.format(index), dependencies.get(index)) for index in range(0, count)]
+    tried = []
+    def trial(subset):
+      names = set(mod.name for mod in subset)
+      tried.append(names)
+      return bad(names)
+
+    suspects, partners, confirmed = ck2launcher.bisectMods(mods, trial)
+    if suspects is not None:
+      suspects = [mod.name for mod in suspects]
+      partners = [mod.name for mod in partners]
+    return suspects, partners, confirmed, tried
+
+
+  def testSingleCulprit(self):
+    suspects, partners, confirmed, tried = self.bisect(16, lambda names: 'm5' in names)
+    self.assertEqual((suspects, partners, confirmed), (['m5'], [], True))
+    self.assertTrue(len(tried) <= 8)
+
+
+  def testOnlyBadTogether(self):
+    suspects, partners, confirmed, tried = self.bisect(16, lambda names: 'm2' in names and 'm9' in names)
+    self.assertEqual((suspects, partners, confirmed), (['m9'], ['m2'], True))
+
+
+  def testDependencyClosure(self):
+    # m6 needs m3, m3 needs m1: every tried set has to contain the dependencies of its mods
+    dependencies = {6: ['m3'], 3: ['m1']}
+    suspects, partners, confirmed, tried = self.bisect(8, lambda names: 'm6' in names, dependencies)
+    self.assertEqual((suspects, partners, confirmed), (['m6'], [], True))
+    for names in tried:
+      for index, needed in dependencies.items():
+	if 'm{0}'.format(index) in names:
+	  self.assertTrue(set(needed) <= names)
+
+
+  def testNotSplittable(self):
+    # Mods that depend on each other are reported together
+    suspects, partners, confirmed, tried = self.bisect(8, lambda names: 'm4' in names, {4: ['m5'], 5: ['m4']})
+    self.assertEqual((suspects, partners, confirmed), (['m4', 'm5'], [], True))
+
+
+  def testNoCulprit(self):
+    suspects, partners, confirmed, tried = self.bisect(16, lambda names: False)
+    self.assertEqual((suspects, partners, confirmed), (None, None, False))
+    self.assertEqual(len(tried), 1)
+
+
+  def testBadWithoutMods(self):
+    suspects, partners, confirmed, tried = self.bisect(16, lambda names: True)
+    self.assertEqual((suspects, partners, confirmed), ([], [], True))
+    self.assertEqual(len(tried), 2)
+
+# END CLASS BisectModsTest
+
+
+
+class StubGameTest(unittest.TestCase):
+  '''The bisect command running the stub game binary
+  '''
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    os.makedirs(self.directory + '/mod')
+    os.makedirs(self.directory + '/game/dlc')
+    shutil.copy(STUBGAME, self.directory + '/game/ck2')
+    for index in range(0, 8):
+      modfile = open('{0}/mod/m{1}.mod'.format(self.directory, index), 'w')
+      modfile.write('name = "M{0}"\n'.format(index))
+      modfile.close()
+
+    self.saved = dict((name, getattr(ck2launcher, name)) for name in ['CONFIG_FILE', 'CACHE_DIR', 'HISTORY_FILE', 'GAME_POLL_INTERVAL'])
+    ck2launcher.CONFIG_FILE = self.directory + '/ck2launcher.conf'
+    ck2launcher.CACHE_DIR = self.directory + '/cache'
+    ck2launcher.HISTORY_FILE = self.directory + '/ck2launcher.db'
+    ck2launcher.GAME_POLL_INTERVAL = 100
+
+    self.environ = dict(os.environ)
+    os.environ['STUB_LOG'] = self.directory + '/game.log'
+
+    # Keep the messages to check the outcome
+    self.messages = []
+    self.saved['okMsg'] = ck2launcher.okMsg
+    ck2launcher.okMsg = self.messages.append
+
+
+  def tearDown(self):
+    for name, value in self.saved.items():
+      setattr(ck2launcher, name, value)
+    os.environ.clear()
+    os.environ.update(self.environ)
+    shutil.rmtree(self.directory)
+
+
+  def bisect(self, readymarker, *arguments):
+    configfile = open(ck2launcher.CONFIG_FILE, 'w')
+    configfile.write('[launcher]\nmodpath = {0}/mod\ngamepath = {0}/game\ngamebinary = ck2\nreadylog = {0}/game.log\nreadymarker = {1}\n'.format(self.directory, readymarker))
+    configfile.write('selectedmods = {0}\n'.format(','.join('m{0}.mod'.format(index) for index in range(0, 8))))
+    configfile.close()
+    return ck2launcher.runCommand(['bisect'] + list(arguments))
+
+
+  def testCrashingMod(self):
+    os.environ['STUB_CRASH'] = 'mod/m6.mod'
+    self.assertEqual(self.bisect('Main menu', '--timeout', '10'), 1)
+    self.assertTrue('Culprit: "M6"' in self.messages[-1])
+
+
+  def testCrashingPair(self):
+    os.environ['STUB_CRASH'] = 'mod/m1.mod+mod/m4.mod'
+    self.assertEqual(self.bisect('Main menu', '--timeout', '10'), 1)
+    # Which of the two is found first depends on the order the mods are loaded in
+    self.assertTrue('is only bad together with' in self.messages[-1])
+    self.assertTrue('"M1"' in self.messages[-1] and '"M4"' in self.messages[-1])
+
+
+  def testNoCulprit(self):
+    self.assertEqual(self.bisect('Main menu', '--timeout', '10'), 0)
+
+
+  def testBadWithoutMods(self):
+    # The game never writes this marker, so every run times out
+    self.assertEqual(self.bisect('Never shown', '--timeout', '1'), 2)
+
+# END CLASS StubGameTest
+
+
+if __name__ == '__main__':
+  unittest.main()